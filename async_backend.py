@@ -0,0 +1,243 @@
+import os
+import asyncio
+import hashlib
+import threading
+from time import perf_counter
+
+try:
+    import aiohttp
+except ImportError:  # Optional, only needed when the asyncio backend is selected
+    aiohttp = None
+
+from drive_core import (
+    FOLDER_MIME_TYPE,
+    LIST_FIELDS,
+    LIST_PAGE_SIZE,
+    PART_SUFFIX,
+    VERIFY_RETRIES,
+    file_record,
+    file_size,
+    is_workspace_file,
+    safe_name,
+)
+from metrics import endpoint_name
+from rate_limit import MAX_RETRIES, error_reason, is_quota_error, is_retryable
+
+ASYNC_CONCURRENCY = 512  # Requests kept in flight at once by the event loop
+
+
+class AsyncBackend:
+    """Runs DriveDownloader's listing and download loops on a single asyncio event loop."""
+
+    def __init__(self, app, concurrency=ASYNC_CONCURRENCY):
+        if aiohttp is None:
+            raise RuntimeError("The asyncio backend needs aiohttp: pip install aiohttp")
+        self.app = app
+        self.concurrency = concurrency
+
+    def fetch_all_files(self, folder_id, current_path="", folders=None, errors=None, fresh=False):
+        return asyncio.run(self.crawl(folder_id, current_path, folders, errors, fresh))
+
+    def download_files(self, files):
+        # Workspace exports keep the app's threaded pool, they are few and slow
+        exporter = threading.Thread(
+            target=self.app.export_files, args=([file for file in files if is_workspace_file(file)],), daemon=True
+        )
+        exporter.start()
+        asyncio.run(self.download_all([file for file in files if not is_workspace_file(file)]))
+        exporter.join()
+
+    def client(self):
+        # One shared client for the whole run; its connector caps the sockets opened at once
+        connector = aiohttp.TCPConnector(limit=self.concurrency, ttl_dns_cache=300)
+        timeout = aiohttp.ClientTimeout(sock_connect=30, sock_read=300)
+        return aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+    async def get(self, session, url, params=None, headers=None):
+        # Same policy as DriveTransport.get: bearer token, one refresh on 401, backoff on quota errors
+        accounts = self.app.accounts
+        transport = self.app.transport
+        metrics = self.app.metrics
+        endpoint = endpoint_name(url, params)
+        refreshed = False
+        attempt = 0
+        while True:
+            account = accounts.take()
+            rate = account.rate
+            await rate.acquire_async()
+            token = transport.token(account)
+            request_headers = dict(headers or {})
+            request_headers["Authorization"] = f"Bearer {token}"
+            started = perf_counter()
+            try:
+                response = await session.get(url, params=params, headers=request_headers)
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                metrics.observe(endpoint, perf_counter() - started, "connection", retry=bool(attempt or refreshed))
+                if attempt == MAX_RETRIES:
+                    raise
+                await asyncio.sleep(rate.backoff(attempt))
+                attempt += 1
+                continue
+            metrics.observe(endpoint, perf_counter() - started, response.status, retry=bool(attempt or refreshed))
+
+            if response.status == 401 and not refreshed:
+                response.release()
+                transport.force_refresh(account, token)
+                refreshed = True
+                continue
+            if response.status < 400:
+                rate.on_success()
+                return response
+
+            reason = error_reason(await response.read()) if response.status == 403 else None
+            if not is_retryable(response.status, reason) or attempt == MAX_RETRIES:
+                return response
+            response.release()
+            quota = is_quota_error(response.status, reason)
+            await asyncio.sleep(accounts.backoff(account, attempt, response.headers.get("Retry-After"), quota))
+            attempt += 1
+
+    async def crawl(self, folder_id, current_path, folders, errors=None, fresh=False):
+        all_files = []
+        if folders is not None:
+            folders[folder_id] = current_path
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async with self.client() as session:
+            async def walk(fid, path, modified_time):
+                try:
+                    async with semaphore:
+                        items = await self.list_folder(session, fid, modified_time, fresh)
+                except Exception as e:
+                    print(f"Error fetching file list for {path or fid}: {e}")
+                    if errors is not None:
+                        errors[path or fid] = e
+                    return
+
+                subfolders = []
+                for item in items:
+                    if item["mimeType"] == FOLDER_MIME_TYPE:
+                        if not self.app.filters.walks(item["name"]):
+                            continue  # Excluded subtree, never listed
+                        subfolder_path = os.path.join(path, safe_name(item["name"]))
+                        if folders is not None:
+                            folders[item["id"]] = subfolder_path
+                        subfolders.append(walk(item["id"], subfolder_path, item.get("modifiedTime")))
+                    elif self.app.filters.matches(item):
+                        all_files.append(file_record(item, path))
+                await asyncio.gather(*subfolders)
+
+            await walk(folder_id, current_path, None)
+        return all_files
+
+    async def list_folder(self, session, folder_id, modified_time=None, fresh=False):
+        cache = self.app.listing_cache
+        key = self.app.listing_key(folder_id)
+        items = None if fresh else cache.get(key, modified_time)
+        if items is not None:
+            return items
+
+        items = []
+        params = {
+            "q": self.app.listing_query(folder_id),
+            "fields": LIST_FIELDS,
+            "pageSize": str(LIST_PAGE_SIZE),
+        }
+        while True:
+            response = await self.get(session, self.app.files_url, params=params)
+            async with response:
+                response.raise_for_status()
+                results = await response.json()
+            items.extend(results.get("files", []))
+            if not results.get("nextPageToken"):
+                cache.put(key, items, modified_time)
+                return items
+            params["pageToken"] = results["nextPageToken"]
+
+    async def download_all(self, files):
+        app = self.app
+        semaphore = asyncio.Semaphore(self.concurrency)
+        loop = asyncio.get_running_loop()
+
+        async with self.client() as session:
+            async def run(file):
+                async with semaphore:
+                    if not app.downloading:
+                        return
+                    if app.skip_imported(file):
+                        return
+
+                    output_dir = os.path.join(app.save_dir, file["path"])
+                    size = int(file["size"]) if file.get("size") is not None else None
+                    try:
+                        for attempt in range(VERIFY_RETRIES + 1):
+                            if size is not None and size >= app.segment_threshold:
+                                # Large files gain nothing from the event loop, they keep the segmented path
+                                status, full_path = await loop.run_in_executor(None, app.download_file, file, output_dir)
+                            else:
+                                status, full_path = await self.download_file(session, file, output_dir)
+                            if status != "corrupt":
+                                break
+                            with app.lock:
+                                app.claimed_paths.discard(full_path)
+                        else:
+                            status = "failed"
+                    except Exception as e:
+                        # One file the disk refuses must not stop the gather() of all the others
+                        app.show_error(f"Failed to download {file['path']}/{file['name']}: {e}")
+                        status, full_path = "failed", None
+                    app.record_result(file, status, full_path)
+
+            # Largest first: they take the longest, and the semaphore lets small files fill in around them
+            ordered = sorted(files, key=file_size, reverse=True)
+            await asyncio.gather(*(run(file) for file in ordered))
+
+    async def download_file(self, session, file, output_dir):
+        # Whole-file download of a small file, with the same skip/rename and verification as the threaded path
+        app = self.app
+        file_name = file["name"]
+        local_name = app.local_name(file)
+        full_path = app.resume_path(file) or app.get_filename(output_dir, local_name, file.get("size"), file["id"])
+        if not full_path:
+            return "skipped", os.path.join(output_dir, local_name)  # Skip if no download needed
+
+        os.makedirs(output_dir, exist_ok=True)
+        part_path = full_path + PART_SUFFIX
+        digest = hashlib.md5()
+        downloaded = 0
+        try:
+            response = await self.get(session, f"{app.files_url}/{file['id']}", params={"alt": "media"})
+            async with response:
+                response.raise_for_status()
+                total_size = int(response.headers.get("Content-Length", 0))
+                expected_size = int(file["size"]) if file.get("size") is not None else total_size
+                body_started = perf_counter()
+                with open(part_path, "wb") as f, app.progress.transfer(file_name, expected_size) as transfer:
+                    async for chunk in response.content.iter_chunked(32768):
+                        if not app.downloading:
+                            break
+                        app.metrics.write(f, chunk)
+                        digest.update(chunk)
+                        downloaded += len(chunk)
+                        transfer.advance(len(chunk))
+                app.metrics.add_body("files.download", downloaded, perf_counter() - body_started)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print(f"Failed to download {file_name}: {e}")
+            app.discard_partial(part_path)
+            return "failed", full_path
+
+        if not app.downloading or downloaded != expected_size:
+            # Small files are cheaper to fetch again than to resume
+            if app.downloading:
+                print(f"Size mismatch for {file_name}: got {downloaded} bytes, expected {expected_size}.")
+            app.discard_partial(part_path)
+            return ("partial" if not app.downloading else "failed"), full_path
+        if file.get("md5Checksum") and digest.hexdigest() != file["md5Checksum"]:
+            print(f"Checksum mismatch for {file_name}, queued for another attempt.")
+            app.discard_partial(part_path)
+            return "corrupt", full_path
+
+        os.replace(part_path, full_path)
+        app.discard_partial(part_path)  # Drops a sidecar left by an earlier threaded attempt
+        print(f"Downloaded {file_name} successfully.")
+        return "done", full_path
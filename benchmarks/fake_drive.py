@@ -0,0 +1,383 @@
+"""A local stand-in for the parts of the Drive v3 API the downloader calls.
+
+    python benchmarks/fake_drive.py [--depth 2 --fanout 3 --files 50 --size 4K-1M --latency 20 ...]
+
+Serves files.list ("'<id>' in parents" with pageSize and pageToken), files.get, batch requests of
+files.get, changes.getStartPageToken and alt=media downloads with Range. File bytes are generated
+from the file id, so a large tree costs no memory. Any token is accepted; with --quota each one is
+held to that many calls per second, like a service account, and answered 403 userRateLimitExceeded
+beyond it.
+
+GET /_stats returns the calls served per endpoint and the errors injected; /_stats?reset=1 also
+clears them.
+"""
+import os
+import re
+import sys
+import json
+import random
+import hashlib
+import argparse
+import threading
+from collections import Counter
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import sleep, monotonic
+from urllib.parse import parse_qs, urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from filters import parse_size
+
+FOLDER_MIME_TYPE = "application/vnd.google-apps.folder"
+MODIFIED_TIME = "2024-01-01T00:00:00.000Z"
+PATTERN = random.Random(0).getrandbits(8 * 64 * 1024).to_bytes(64 * 1024, "little")  # Body of every file, after a header
+HEADER_BYTES = 32
+SEND_BLOCK = 256 * 1024
+MAX_PAGE_SIZE = 1000  # Largest pageSize Drive honours
+ERROR_BODIES = {
+    403: ("userRateLimitExceeded", "User Rate Limit Exceeded"),
+    429: ("rateLimitExceeded", "Rate Limit Exceeded"),
+    500: ("backendError", "Backend Error"),
+    503: ("backendError", "Service Unavailable"),
+}
+
+
+class FakeTree:
+    """Folders and files of a generated Drive tree: depth levels of fanout folders, files in every folder."""
+
+    def __init__(self, depth=2, fanout=3, files=50, size="64K", seed=0, root_id="root", root_name="Benchmark",
+                 name_repeat=1):
+        self.root_id = root_id
+        self.children = {}  # Folder id -> items as files().list returns them
+        self.items = {}  # Id -> item, folders included
+        self.sizes = self.parse_sizes(size)
+        self.random = random.Random(seed)
+
+        self.items[root_id] = {"id": root_id, "name": root_name, "mimeType": FOLDER_MIME_TYPE,
+                               "modifiedTime": MODIFIED_TIME}
+        level = [root_id]
+        for current in range(depth + 1):
+            next_level = []
+            for folder_id in level:
+                children = self.children.setdefault(folder_id, [])
+                for index in range(files):
+                    # Drive allows names to repeat in a folder: name_repeat files share each name, far apart
+                    name = f"file{index % -(-files // name_repeat)}.bin"
+                    children.append(self.add_file(f"{folder_id}-f{index}", name))
+                if current < depth:
+                    for index in range(fanout):
+                        child = self.add_folder(f"{folder_id}-d{index}", f"folder{index}")
+                        children.append(child)
+                        next_level.append(child["id"])
+            level = next_level
+
+    @staticmethod
+    def parse_sizes(size):
+        # "64K" for one size, "4K-1M" for sizes spread evenly on a log scale between the two
+        low, _, high = str(size).partition("-")
+        low = parse_size(low)
+        return (low, parse_size(high) if high else low)
+
+    def add_folder(self, folder_id, name):
+        item = {"id": folder_id, "name": name, "mimeType": FOLDER_MIME_TYPE, "modifiedTime": MODIFIED_TIME}
+        self.items[folder_id] = item
+        self.children[folder_id] = []
+        return item
+
+    def add_file(self, file_id, name):
+        low, high = self.sizes
+        size = low if low == high else int(low * (high / max(1, low)) ** self.random.random())
+        digest = hashlib.md5()
+        for block in content(file_id, size, 0, size):
+            digest.update(block)
+        item = {"id": file_id, "name": name, "mimeType": "application/octet-stream", "size": str(size),
+                "md5Checksum": digest.hexdigest(), "modifiedTime": MODIFIED_TIME}
+        self.items[file_id] = item
+        return item
+
+    def files(self):
+        return [item for item in self.items.values() if item["mimeType"] != FOLDER_MIME_TYPE]
+
+    def total_bytes(self):
+        return sum(int(item["size"]) for item in self.files())
+
+
+def content(file_id, size, start, end):
+    # Bytes start..end-1 of a file, in blocks; the header keeps files with the same size from being duplicates
+    header = hashlib.sha256(file_id.encode()).digest()[:HEADER_BYTES]
+    position = start
+    while position < min(end, size):
+        if position < HEADER_BYTES:
+            block = header[position:min(end, HEADER_BYTES)]
+        else:
+            offset = (position - HEADER_BYTES) % len(PATTERN)
+            block = PATTERN[offset:offset + min(end - position, len(PATTERN) - offset)]
+        yield block
+        position += len(block)
+
+
+class FakeDriveServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024  # The asyncio backend opens hundreds of connections at once
+
+    def __init__(self, tree, port=0, latency=0.0, error_rate=0.0, error_codes=(429, 503), bandwidth=None,
+                 max_page_size=MAX_PAGE_SIZE, seed=0, quota=None):
+        super().__init__(("127.0.0.1", port), FakeDriveHandler)
+        self.tree = tree
+        self.latency = latency  # Seconds added before every response
+        self.error_rate = error_rate  # Share of calls answered with one of error_codes instead
+        self.error_codes = list(error_codes)
+        self.bandwidth = bandwidth  # Bytes per second of one media response, None for as fast as possible
+        self.max_page_size = max_page_size
+        self.quota = quota  # Calls per second allowed to one bearer token, None for no limit
+        self.quota_windows = {}  # Token -> (second, calls made in it)
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = Counter()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_port}/"
+
+    def count(self, key, amount=1):
+        with self.lock:
+            self.stats[key] += amount
+
+    def injected_error(self):
+        with self.lock:
+            if self.error_codes and self.random.random() < self.error_rate:
+                status = self.random.choice(self.error_codes)
+                self.stats[f"error {status}"] += 1
+                return status
+        return None
+
+    def over_quota(self, token):
+        if not self.quota:
+            return None
+        second = int(monotonic())
+        with self.lock:
+            window, count = self.quota_windows.get(token, (second, 0))
+            if window != second:
+                count = 0
+            self.quota_windows[token] = (second, count + 1)
+            if count < self.quota:
+                return None
+            self.stats["error 403 quota"] += 1
+        return 403
+
+    def take_stats(self, reset=False):
+        with self.lock:
+            stats = dict(self.stats)
+            if reset:
+                self.stats.clear()
+        return stats
+
+
+class FakeDriveHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive, like the real API
+    disable_nagle_algorithm = True  # Headers and body go out in separate writes
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        if url.path == "/_stats":
+            return self.send_json(200, self.server.take_stats(reset="reset" in params))
+
+        sleep(self.server.latency)
+        status, body = self.route(url.path, params)
+        if status == "media":
+            return self.send_media(body)
+        self.send_json(status, body)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length)
+        sleep(self.server.latency)
+        if urlsplit(self.path).path.startswith("/batch/"):
+            return self.send_batch(body)
+        self.send_json(404, error_body(404, "notFound", "Not Found"))
+
+    def route(self, path, params, inner=False):
+        # (status, JSON body), or ("media", item) for a download to stream
+        server = self.server
+        if path == "/drive/v3/files":
+            endpoint = "files.list"
+        elif path == "/drive/v3/changes/startPageToken":
+            endpoint = "changes.getStartPageToken"
+        elif path.startswith("/drive/v3/files/"):
+            endpoint = "media" if params.get("alt") == "media" else "files.get"
+        else:
+            return 404, error_body(404, "notFound", "Not Found")
+        server.count(f"batch {endpoint}" if inner else endpoint)
+
+        status = server.over_quota(self.headers.get("Authorization", "")) or server.injected_error()
+        if status:
+            return status, error_body(status, *ERROR_BODIES.get(status, ("backendError", "Error")))
+
+        if endpoint == "changes.getStartPageToken":
+            return 200, {"startPageToken": "1"}
+        if endpoint == "files.list":
+            return 200, self.list_page(params)
+
+        item = server.tree.items.get(path.rsplit("/", 1)[1])
+        if item is None:
+            return 404, error_body(404, "notFound", "File not found.")
+        if endpoint == "media":
+            if item["mimeType"] == FOLDER_MIME_TYPE:
+                return 403, error_body(403, "fileNotDownloadable", "Only files with binary content can be downloaded.")
+            return "media", item
+        return 200, item
+
+    def list_page(self, params):
+        match = re.search(r"'([^']+)' in parents", params.get("q", ""))
+        children = self.server.tree.children.get(match.group(1), []) if match else []
+        page_size = min(int(params.get("pageSize") or 100), self.server.max_page_size)
+        start = int(params.get("pageToken") or 0)
+        result = {"files": children[start:start + page_size]}
+        if start + page_size < len(children):
+            result["nextPageToken"] = str(start + page_size)
+        return result
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=UTF-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_media(self, item):
+        size = int(item["size"])
+        start, end = 0, size
+        match = re.fullmatch(r"bytes=(\d+)-(\d*)", self.headers.get("Range") or "")
+        if match:
+            start = int(match.group(1))
+            end = min(size, int(match.group(2)) + 1) if match.group(2) else size
+            if start >= size:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{size}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end - 1}/{size}")
+        else:
+            self.send_response(200)
+        self.send_header("Content-Type", item["mimeType"])
+        self.send_header("Content-Length", str(end - start))
+        self.end_headers()
+
+        began = monotonic()
+        sent = 0
+        buffer = bytearray()
+        try:
+            for block in content(item["id"], size, start, end):
+                buffer += block
+                if len(buffer) >= SEND_BLOCK:
+                    sent += self.send_block(buffer, began, sent)
+                    buffer = bytearray()
+            if buffer:
+                sent += self.send_block(buffer, began, sent)
+        except (ConnectionResetError, BrokenPipeError):
+            self.close_connection = True  # The client went away: a pause, an aborted segment, a killed worker
+        self.server.count("media bytes", sent)
+
+    def send_block(self, block, began, sent):
+        bandwidth = self.server.bandwidth
+        if bandwidth:
+            ahead = (sent + len(block)) / bandwidth - (monotonic() - began)
+            if ahead > 0:
+                sleep(ahead)
+        self.wfile.write(block)
+        return len(block)
+
+    def send_batch(self, body):
+        # multipart/mixed in, multipart/mixed out: one application/http part per inner call
+        message = BytesParser().parsebytes(
+            b"Content-Type: " + self.headers.get("Content-Type", "").encode() + b"\r\n\r\n" + body
+        )
+        self.server.count("batch")
+        boundary = "batch_fake_drive"
+        parts = []
+        for part in message.get_payload():
+            payload = part.get_payload(decode=True) or b""
+            request_line = payload.split(b"\r\n", 1)[0].decode()
+            target = request_line.split(" ")[1]
+            url = urlsplit(target)
+            params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+            status, result = self.route(url.path, params, inner=True)
+            if status == "media":
+                status, result = 400, error_body(400, "badRequest", "Media downloads cannot be batched.")
+            data = json.dumps(result)
+            content_id = (part["Content-ID"] or "<>")[1:-1]
+            parts.append(
+                f"--{boundary}\r\nContent-Type: application/http\r\nContent-ID: <response-{content_id}>\r\n\r\n"
+                f"HTTP/1.1 {status} {self.responses.get(status, ('',))[0]}\r\n"
+                f"Content-Type: application/json; charset=UTF-8\r\nContent-Length: {len(data)}\r\n\r\n{data}\r\n"
+            )
+        data = ("".join(parts) + f"--{boundary}--\r\n").encode()
+        self.send_response(200)
+        self.send_header("Content-Type", f"multipart/mixed; boundary={boundary}")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def error_body(status, reason, message):
+    return {"error": {"code": status, "message": message, "errors": [{"reason": reason, "message": message}]}}
+
+
+def add_arguments(parser):
+    # Shared with throughput.py, which starts this script with the options of each scenario
+    parser.add_argument("--depth", type=int, default=2, help="folder levels below the root (default: 2)")
+    parser.add_argument("--fanout", type=int, default=3, help="subfolders in every folder (default: 3)")
+    parser.add_argument("--files", type=int, default=50, help="files in every folder (default: 50)")
+    parser.add_argument("--size", default="64K", help='file size, or a range like "4K-1M" (default: 64K)')
+    parser.add_argument("--latency", type=float, default=0.0, metavar="MS", help="added before every response")
+    parser.add_argument("--bandwidth", type=parse_size, metavar="SIZE", help="bytes per second of one download")
+    parser.add_argument("--page-size", type=int, default=MAX_PAGE_SIZE, help="largest files.list page served")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of calls answered with an error")
+    parser.add_argument("--error-codes", default="429,503", help="statuses injected (default: 429,503)")
+    parser.add_argument("--name-repeat", type=int, default=1, metavar="N",
+                        help="N files of a folder share each name (default: 1, every name unique)")
+    parser.add_argument("--quota", type=float, metavar="N", help="calls per second allowed to one bearer token")
+    parser.add_argument("--seed", type=int, default=0)
+
+
+def start_server(args, port=0):
+    tree = FakeTree(depth=args.depth, fanout=args.fanout, files=args.files, size=args.size, seed=args.seed,
+                    name_repeat=max(1, args.name_repeat))
+    server = FakeDriveServer(
+        tree, port=port, latency=args.latency / 1000, error_rate=args.error_rate,
+        error_codes=[int(code) for code in args.error_codes.split(",") if code], bandwidth=args.bandwidth,
+        max_page_size=args.page_size, seed=args.seed, quota=args.quota,
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve a generated folder tree the way the Drive API would.")
+    add_arguments(parser)
+    parser.add_argument("--port", type=int, default=0, help="0 picks a free port")
+    args = parser.parse_args(argv)
+
+    server = start_server(args, args.port)
+    tree = server.tree
+    # First line is read by throughput.py
+    print(json.dumps({"url": server.url, "root_id": tree.root_id, "files": len(tree.files()),
+                      "folders": len(tree.children), "bytes": tree.total_bytes()}), flush=True)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    server.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,127 @@
+"""Several downloader processes sharing one job through --queue, against benchmarks/fake_drive.py.
+
+    python benchmarks/queue_workers.py [--processes 3] [--kill-after SECONDS] [fake_drive.py options ...]
+
+Starts a fake server and N processes in queue mode on one save path, as N hosts on a shared
+folder would run, then checks that every file ended up done, at a path of its own and with its
+bytes. By default every two files of a folder share a name, so two processes often want the same
+path. --kill-after stops one process mid-job with SIGKILL; its files must reach the others once
+--lease runs out. Exits with 1 when a check fails.
+"""
+import os
+import sys
+import json
+import shutil
+import sqlite3
+import argparse
+import tempfile
+import subprocess
+from collections import Counter
+from contextlib import redirect_stdout
+from time import perf_counter, sleep
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from drive_core import file_md5
+from manifest import MANIFEST_NAME
+from throughput import BenchmarkDownloader, server_stats, start_server
+
+# Slow enough that the processes waiting for the listing still find work when they look again
+DEFAULT_TREE = ["--depth", "1", "--fanout", "3", "--files", "100", "--size", "16K", "--name-repeat", "2", "--latency", "50"]
+
+
+def run_worker(url, root_id, save_dir, lease, workers):
+    # One queue process; reports what it did as a JSON line on stdout
+    cache_path = os.path.join(os.path.dirname(save_dir), f"listing_cache_{os.getpid()}.sqlite3")  # One per host
+    app = BenchmarkDownloader(url, cache_path)
+    app.folder_links = [f"https://drive.google.com/drive/folders/{root_id}"]
+    app.save_dir = save_dir
+    app.queue_mode = True
+    app.lease_seconds = lease
+    app.worker_count = workers
+    app.exists_action = "rename"  # Same-named files must all be kept
+    app.downloading = True
+    with redirect_stdout(sys.stderr):
+        app.process_links()
+    print(json.dumps({"pid": os.getpid(), "counts": app.statuses, "errors": app.errors}), flush=True)
+    return 0
+
+
+def check_manifest(save_dir, expected):
+    # Problems found in the shared manifest and on disk, an empty list when the job is complete
+    db = sqlite3.connect(os.path.join(save_dir, MANIFEST_NAME))
+    rows = db.execute("SELECT id, md5, local_path, status FROM files").fetchall()
+    db.close()
+    problems = []
+    statuses = Counter(status for _, _, _, status in rows)
+    if statuses["done"] != expected:
+        problems.append(f"{statuses['done']} of {expected} files done ({dict(statuses)})")
+    paths = Counter(os.path.normcase(local_path) for _, _, local_path, status in rows if status == "done")
+    problems.extend(f"{count} files share {path}" for path, count in paths.items() if count > 1)
+    for file_id, md5, local_path, status in rows:
+        if status != "done":
+            continue
+        if not os.path.isfile(local_path):
+            problems.append(f"{file_id}: {local_path} is missing")
+        elif md5 and file_md5(local_path).hexdigest() != md5:
+            problems.append(f"{file_id}: {local_path} holds other bytes")
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run several --queue processes on one job against a fake Drive.")
+    parser.add_argument("--processes", type=int, default=3, help="queue processes started (default: 3)")
+    parser.add_argument("--workers", type=int, default=4, help="download workers in each process (default: 4)")
+    parser.add_argument("--lease", type=int, default=10, metavar="SECONDS",
+                        help="lease of a file before it is handed to another process (default: 10)")
+    parser.add_argument("--kill-after", type=float, metavar="SECONDS", help="SIGKILL the first process after this long")
+    parser.add_argument("--worker", nargs=3, metavar=("URL", "ROOT_ID", "SAVE_DIR"), help=argparse.SUPPRESS)
+    args, tree_options = parser.parse_known_args(argv)
+    if args.worker:
+        return run_worker(*args.worker, args.lease, args.workers)
+
+    server, tree = start_server(tree_options or DEFAULT_TREE)
+    work_dir = tempfile.mkdtemp(prefix="drive_queue_")
+    save_dir = os.path.join(work_dir, "save")
+    try:
+        command = [sys.executable, os.path.abspath(__file__), "--lease", str(args.lease),
+                   "--workers", str(args.workers), "--worker", tree["url"], tree["root_id"], save_dir]
+        start = perf_counter()
+        processes = [
+            subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+            for _ in range(max(1, args.processes))
+        ]
+        if args.kill_after is not None:
+            sleep(args.kill_after)
+            processes[0].kill()
+
+        reports = []
+        for process in processes:
+            output, _ = process.communicate()
+            if process.returncode == 0 and output.strip():
+                reports.append(json.loads(output.strip().splitlines()[-1]))
+            else:
+                reports.append({"pid": process.pid, "killed": True})
+        seconds = perf_counter() - start
+        stats = server_stats(tree["url"])
+        problems = check_manifest(save_dir, tree["files"])
+    finally:
+        server.terminate()
+        server.wait()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    for report in reports:
+        if report.get("killed"):
+            print(f"process {report['pid']}: killed")
+        else:
+            errors = f", {len(report['errors'])} errors" if report["errors"] else ""
+            print(f"process {report['pid']}: {dict(report['counts'])}{errors}")
+    print(f"{tree['files']} files, {stats.get('media', 0)} downloads served, {seconds:.2f} s")
+    for problem in problems:
+        print(f"Problem: {problem}")
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,72 @@
+"""Cold-start timings of the downloader, each measured in a fresh interpreter.
+
+    python benchmarks/startup.py [--runs N] [--budget MS]
+
+With --budget the script exits with 1 when the median of "cli ready" is slower,
+so a change that pulls a heavy import back into startup shows up at once.
+"""
+import os
+import sys
+import argparse
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# name -> code run in a new interpreter, timed from the moment the interpreter is up
+SCENARIOS = {
+    "import drive_core": "import drive_core",
+    "cli ready": "import drive_cli; drive_cli.HeadlessDownloader(sys.stdout)",
+    "import gui module": "import drive_downloader",
+    "drive client from bundled document": (
+        "from google.auth.credentials import AnonymousCredentials\n"
+        "from drive_service import build_drive_service\n"
+        "build_drive_service(AnonymousCredentials())"
+    ),
+}
+
+TIMER = """
+import sys
+from time import perf_counter
+sys.path.insert(0, {root!r})
+start = perf_counter()
+{code}
+print(perf_counter() - start)
+"""
+
+
+def measure(code, runs):
+    timings = []
+    for _ in range(runs):
+        script = TIMER.format(root=ROOT, code=code)
+        result = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, cwd=ROOT)
+        if result.returncode != 0:
+            raise RuntimeError(result.stderr.strip())
+        timings.append(float(result.stdout.strip().splitlines()[-1]) * 1000)
+    return timings
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure how long the downloader takes to start.")
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters per scenario (default: 5)")
+    parser.add_argument("--budget", type=float, help='fail when "cli ready" takes longer than this many ms')
+    args = parser.parse_args(argv)
+
+    medians = {}
+    for name, code in SCENARIOS.items():
+        try:
+            timings = measure(code, args.runs)
+        except RuntimeError as e:
+            print(f"{name:<38} skipped: {str(e).splitlines()[-1] if str(e) else 'failed'}")
+            continue
+        medians[name] = statistics.median(timings)
+        print(f"{name:<38} median {medians[name]:8.1f} ms   max {max(timings):8.1f} ms")
+
+    if args.budget is not None and medians.get("cli ready", 0) > args.budget:
+        print(f'"cli ready" is over the budget of {args.budget:.0f} ms')
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,209 @@
+"""Listing and download throughput of the downloader against benchmarks/fake_drive.py.
+
+    python benchmarks/throughput.py [--runs N] [--scenario NAME] [--save FILE] [--compare FILE]
+
+Every run starts a fresh fake server in its own process, so serving does not compete with the
+downloader for the GIL, and downloads the whole tree into an empty folder. --save keeps the
+medians as JSON; --compare exits with 1 when files/s or MB/s of a scenario fell more than
+--tolerance below the saved numbers, so a regression shows up without a Google account.
+"""
+import os
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+import statistics
+import subprocess
+import urllib.request
+from collections import Counter
+from contextlib import redirect_stdout
+from time import perf_counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from google.auth.credentials import Credentials
+
+from drive_core import DriveDownloader
+from credential_pool import CredentialPool, ServiceAccount
+from listing_cache import ListingCache
+from rate_limit import RateController
+
+SERVER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake_drive.py")
+UNPACED_RATE = 10000.0  # Requests per second; the fake server has no quota to stay under
+
+# name -> (fake_drive.py options, DriveDownloader settings)
+SCENARIOS = {
+    "small files": (["--depth", "1", "--fanout", "4", "--files", "200", "--size", "4K"], {"worker_count": 8}),
+    "small files, async": (["--depth", "1", "--fanout", "4", "--files", "200", "--size", "4K"], {"use_async": True}),
+    "mixed sizes": (["--depth", "2", "--fanout", "3", "--files", "20", "--size", "1K-4M"], {"worker_count": 8}),
+    "large files, segmented": (["--depth", "0", "--files", "6", "--size", "48M"],
+                               {"worker_count": 2, "segment_threshold": 32 * 1024 * 1024}),
+    "deep tree": (["--depth", "5", "--fanout", "3", "--files", "2", "--size", "1K"], {"worker_count": 8}),
+    "paged listing": (["--depth", "0", "--files", "3000", "--size", "512", "--page-size", "100"],
+                      {"worker_count": 8}),
+    "latency 50 ms": (["--depth", "1", "--fanout", "2", "--files", "50", "--size", "16K", "--latency", "50"],
+                      {"worker_count": 8}),
+    "flaky server": (["--depth", "1", "--fanout", "2", "--files", "100", "--size", "16K",
+                      "--error-rate", "0.02", "--error-codes", "429,500,503"], {"worker_count": 8}),
+    # Each token held to 20 calls/s and paced like a real account: throughput should grow with the keys
+    "quota, 1 account": (["--depth", "0", "--files", "200", "--size", "4K", "--quota", "20"],
+                         {"worker_count": 8, "paced": True, "account_count": 1}),
+    "quota, 4 accounts": (["--depth", "0", "--files", "200", "--size", "4K", "--quota", "20"],
+                          {"worker_count": 8, "paced": True, "account_count": 4}),
+}
+
+
+class StaticCredentials(Credentials):
+    """Stands in for a service account: the fake server takes any bearer token."""
+
+    def __init__(self, token="benchmark"):
+        super().__init__()
+        self.token = token
+
+    def refresh(self, request):
+        pass
+
+
+class BenchmarkDownloader(DriveDownloader):
+    """DriveDownloader aimed at the fake server, counting results instead of showing them."""
+
+    def __init__(self, api_root, cache_path, paced=False):
+        super().__init__()
+        self.api_root = api_root
+        self.paced = paced
+        self.account_count = 1  # Keys in the pool, each with its own token and rate
+        self.listing_cache.close()
+        self.listing_cache = ListingCache(cache_path)  # Never the user's cache, and empty for every run
+        self.statuses = Counter()
+        self.errors = []
+
+    def load_accounts(self):
+        with self.service_lock:
+            if self.accounts is None:
+                accounts = []
+                for index in range(self.account_count):
+                    rate = None if self.paced else RateController(rate=UNPACED_RATE, max_rate=UNPACED_RATE)
+                    accounts.append(ServiceAccount(f"benchmark-{index}", rate, StaticCredentials(f"benchmark-{index}")))
+                self.accounts = CredentialPool(accounts, self.metrics)
+        return self.accounts
+
+    def set_status(self, text, color="blue"):
+        pass
+
+    def show_error(self, message):
+        self.errors.append(message)
+
+    def file_finished(self, file, status, local_path):
+        with self.lock:
+            self.statuses[status] += 1
+
+    def report_progress(self, snapshot):
+        pass
+
+
+def start_server(options):
+    server = subprocess.Popen([sys.executable, SERVER] + options, stdout=subprocess.PIPE, text=True)
+    line = server.stdout.readline()
+    if not line:
+        server.wait()
+        raise RuntimeError(f"fake_drive.py exited with {server.returncode}")
+    return server, json.loads(line)
+
+
+def server_stats(url):
+    with urllib.request.urlopen(f"{url}_stats") as response:
+        return json.loads(response.read())
+
+
+def run_once(options, settings, paced=False):
+    server, tree = start_server(options)
+    work_dir = tempfile.mkdtemp(prefix="drive_benchmark_")
+    try:
+        app = BenchmarkDownloader(tree["url"], os.path.join(work_dir, "listing_cache.sqlite3"), paced)
+        app.folder_links = [f"https://drive.google.com/drive/folders/{tree['root_id']}"]
+        app.save_dir = os.path.join(work_dir, "save")
+        for name, value in settings.items():
+            setattr(app, name, value)
+
+        app.downloading = True
+        start = perf_counter()
+        with open(os.devnull, "w") as devnull, redirect_stdout(devnull):  # The engine's own log lines
+            app.process_links()
+        seconds = perf_counter() - start
+
+        stats = server_stats(tree["url"])
+        app.listing_cache.close()
+        if app.manifest:
+            app.manifest.close()
+        if app.transport:
+            app.transport.close()
+    finally:
+        server.terminate()
+        server.wait()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    calls = sum(count for key, count in stats.items() if not key.startswith(("error", "media bytes", "batch files")))
+    return {
+        "seconds": seconds,
+        "files": app.statuses["done"],
+        "failed": sum(app.statuses.values()) - app.statuses["done"] + (tree["files"] - sum(app.statuses.values())),
+        "files_per_second": app.statuses["done"] / seconds,
+        "mb_per_second": stats.get("media bytes", 0) / seconds / 1024 / 1024,
+        "api_calls": calls,
+        "errors_injected": sum(count for key, count in stats.items() if key.startswith("error")),
+        "calls": stats,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure listing and download throughput against a fake Drive.")
+    parser.add_argument("--runs", type=int, default=3, help="runs per scenario, the median is reported (default: 3)")
+    parser.add_argument("--scenario", action="append", choices=list(SCENARIOS), help="only this one (repeatable)")
+    parser.add_argument("--paced", action="store_true",
+                        help="keep the quota pacing of a real account (starts at 10 requests/s)")
+    parser.add_argument("--save", metavar="FILE", help="write the medians as JSON, a baseline for --compare")
+    parser.add_argument("--compare", metavar="FILE", help="fail when slower than the numbers saved in FILE")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="share files/s or MB/s may drop below the baseline (default: 0.25)")
+    args = parser.parse_args(argv)
+
+    results = {}
+    print(f"{'scenario':<24} {'files':>6} {'files/s':>9} {'MB/s':>8} {'API calls':>10} {'errors':>7} {'seconds':>8}")
+    for name in args.scenario or SCENARIOS:
+        options, settings = SCENARIOS[name]
+        try:
+            runs = [run_once(options, settings, args.paced) for _ in range(args.runs)]
+        except (OSError, RuntimeError) as e:
+            print(f"{name:<24} skipped: {e}")
+            continue
+        median = {key: statistics.median(run[key] for run in runs)
+                  for key in ("seconds", "files", "failed", "files_per_second", "mb_per_second", "api_calls",
+                              "errors_injected")}
+        results[name] = median
+        failed = f"  {median['failed']:.0f} not downloaded" if median["failed"] else ""
+        print(f"{name:<24} {median['files']:>6.0f} {median['files_per_second']:>9.1f} {median['mb_per_second']:>8.1f} "
+              f"{median['api_calls']:>10.0f} {median['errors_injected']:>7.0f} {median['seconds']:>8.2f}{failed}")
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        slower = []
+        for name, median in results.items():
+            for key in ("files_per_second", "mb_per_second"):
+                before = baseline.get(name, {}).get(key)
+                if before and median[key] < before * (1 - args.tolerance):
+                    slower.append(f"{name}: {key} {median[key]:.1f}, was {before:.1f}")
+        for line in slower:
+            print(f"Slower than the baseline, {line}")
+        return 1 if slower else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
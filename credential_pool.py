@@ -0,0 +1,129 @@
+import os
+import glob
+import threading
+from time import monotonic, perf_counter, sleep
+
+from googleapiclient.errors import HttpError
+
+from drive_service import load_credentials
+from rate_limit import MAX_RETRIES, RateController, error_reason, is_quota_error, is_retryable
+
+
+class ServiceAccount:
+    """One key of the pool, paced against its own quota."""
+
+    def __init__(self, path, rate=None, credentials=None):
+        self.path = path
+        self.name = os.path.basename(path)
+        self.rate = rate or RateController()
+        self.load_lock = threading.Lock()
+        self.refresh_lock = threading.Lock()  # Held by DriveTransport while it refreshes the token
+        self.loaded = credentials  # Read from the key file on first use
+
+    @property
+    def credentials(self):
+        if self.loaded is None:
+            with self.load_lock:
+                if self.loaded is None:
+                    self.loaded = load_credentials(self.path)
+        return self.loaded
+
+
+class CredentialPool:
+    """Service accounts taken in turn, so a job runs on the quota of all of them.
+
+    Every account needs access to the folders: shared with each one, or through a group or a
+    shared drive. The changes feed is per account, its calls always go to the primary one.
+    """
+
+    def __init__(self, accounts, metrics=None):
+        self.accounts = list(accounts)
+        self.metrics = metrics  # Metrics every API call attempt is recorded in, if any
+        self.lock = threading.Lock()
+        self.turn = 0
+        self.thread_local = threading.local()  # Per-thread HTTP connections for API calls
+
+    @classmethod
+    def from_path(cls, path, metrics=None):
+        # A key file, or a folder of them: every *.json in it, in name order
+        if os.path.isdir(path):
+            paths = sorted(glob.glob(os.path.join(path, "*.json")))
+            if not paths:
+                raise FileNotFoundError(f"No service account keys (*.json) in {path}")
+        else:
+            paths = [path]
+        return cls([ServiceAccount(key_path) for key_path in paths], metrics)
+
+    @property
+    def primary(self):
+        return self.accounts[0]
+
+    def take(self):
+        # Next account in turn that is not held off by a quota error or a backoff; when every one is,
+        # the first to come back, whose rate controller waits for it
+        now = monotonic()
+        with self.lock:
+            for _ in range(len(self.accounts)):
+                account = self.accounts[self.turn]
+                self.turn = (self.turn + 1) % len(self.accounts)
+                if account.rate.blocked_until <= now:
+                    return account
+        return min(self.accounts, key=lambda account: account.rate.blocked_until)
+
+    def backoff(self, account, attempt, retry_after=None, quota=False, rotate=True):
+        # Seconds to wait before the next attempt. An account over its quota sits out its backoff while
+        # the call moves on to another one at once; a lone or pinned account waits as it always did.
+        delay = account.rate.backoff(attempt, retry_after)
+        if quota:
+            account.rate.on_throttle()
+            if rotate and len(self.accounts) > 1:
+                return 0.0
+        return delay
+
+    def http(self, account):
+        # httplib2 is not thread-safe, so every thread gets its own connection for each account
+        connections = getattr(self.thread_local, "connections", None)
+        if connections is None:
+            connections = self.thread_local.connections = {}
+        http = connections.get(account.path)
+        if http is None:
+            from google_auth_httplib2 import AuthorizedHttp
+            from googleapiclient.http import build_http  # httplib2.Http with googleapiclient's 60 s socket timeout
+
+            http = connections[account.path] = AuthorizedHttp(account.credentials, http=build_http())
+        return http
+
+    def execute(self, request, tokens=1, account=None):
+        # Runs a googleapiclient request (anything with execute()), retrying quota and server errors.
+        # Every attempt takes the next account in turn, or always the given one.
+        import httplib2  # Already loaded by googleapiclient once a request exists
+
+        endpoint = getattr(request, "methodId", "batch").replace("drive.", "", 1)  # e.g. "files.list"
+        for attempt in range(MAX_RETRIES + 1):
+            current = account or self.take()
+            current.rate.acquire(tokens)
+            started = perf_counter()
+            try:
+                result = request.execute(http=self.http(current))
+            except HttpError as e:
+                status = int(e.resp.status)
+                self.observe(endpoint, started, status, attempt)
+                reason = error_reason(e.content)
+                if not is_retryable(status, reason) or attempt == MAX_RETRIES:
+                    raise
+                quota = is_quota_error(status, reason)
+                sleep(self.backoff(current, attempt, e.resp.get("retry-after"), quota, rotate=account is None))
+                continue
+            except (OSError, httplib2.HttpLib2Error):
+                self.observe(endpoint, started, "connection", attempt)
+                if attempt == MAX_RETRIES:
+                    raise
+                sleep(current.rate.backoff(attempt))  # Dropped connection or timeout
+                continue
+            self.observe(endpoint, started, 200, attempt)
+            current.rate.on_success()
+            return result
+
+    def observe(self, endpoint, started, code, attempt):
+        if self.metrics:
+            self.metrics.observe(endpoint, perf_counter() - started, code, retry=attempt > 0)
@@ -0,0 +1,55 @@
+import os
+import shutil
+
+try:
+    import fcntl
+except ImportError:  # Windows, where reflinks fall back to a copy
+    fcntl = None
+
+DEDUPE_MODES = ("hardlink", "reflink", "copy")
+FICLONE = 0x40049409  # Linux ioctl sharing the extents of one file with another (btrfs, XFS, bcachefs)
+LINK_SUFFIX = ".dedupe"  # Temporary name while a copy is made, so the target appears in one step
+
+
+def content_key(file):
+    # Two Drive files with the same md5Checksum and size hold the same bytes; Workspace files have neither
+    if not file.get("md5Checksum") or file.get("size") is None:
+        return None
+    return file["md5Checksum"], int(file["size"])
+
+
+def link_file(source, target, mode="hardlink"):
+    # Fills target with the bytes of source and returns how: "hardlink", "reflink" or "copy".
+    # A hardlink or reflink the filesystem refuses falls back to a plain copy.
+    temp_path = target + LINK_SUFFIX
+    if mode == "hardlink":
+        try:
+            os.link(source, temp_path)
+            os.replace(temp_path, target)
+            return "hardlink"
+        except OSError:
+            discard(temp_path)  # Other volume, or a filesystem without links
+
+    if mode == "reflink" and fcntl is not None:
+        try:
+            with open(source, "rb") as src, open(temp_path, "wb") as dst:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            os.replace(temp_path, target)
+            return "reflink"
+        except OSError:
+            discard(temp_path)  # Not a copy-on-write filesystem
+
+    try:
+        shutil.copyfile(source, temp_path)
+        os.replace(temp_path, target)
+    except OSError:
+        discard(temp_path)
+        raise
+    return "copy"
+
+
+def discard(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
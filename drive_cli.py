@@ -0,0 +1,172 @@
+import sys
+import json
+import argparse
+import threading
+from collections import Counter
+from contextlib import redirect_stdout
+
+from drive_core import DEFAULT_EXPORT_FORMATS, EXPORT_MIME_TYPES, EXPORT_WORKERS, DriveDownloader
+from dedupe import DEDUPE_MODES
+from metrics import STATS_INTERVAL
+from filters import FileFilter, parse_size, parse_time
+from work_queue import LEASE_SECONDS
+from listing_cache import DEFAULT_TTL
+
+FAILED_STATUSES = {"failed", "partial", "corrupt"}
+
+
+class HeadlessDownloader(DriveDownloader):
+    """DriveDownloader without a window, reporting progress as one JSON object per line."""
+
+    def __init__(self, out, credentials_file="credentials.json"):
+        super().__init__(credentials_file)
+        self.out = out
+        self.out_lock = threading.Lock()  # Workers report from several threads at once
+        self.counts = Counter()
+        self.errors = 0
+
+    def emit(self, event, **fields):
+        with self.out_lock:
+            self.out.write(json.dumps({"event": event, **fields}) + "\n")
+            self.out.flush()
+
+    def set_status(self, text, color="blue"):
+        self.emit("status", message=text)
+
+    def show_error(self, message):
+        self.errors += 1
+        self.emit("error", message=message)
+
+    def report_progress(self, snapshot):
+        self.emit("progress", **snapshot)
+
+    def file_finished(self, file, status, local_path):
+        with self.out_lock:
+            self.counts[status] += 1
+        self.emit("file", id=file["id"], path=f"{file['path']}/{file['name']}", status=status, local_path=local_path)
+
+
+def read_links(path):
+    # Plain one-link-per-line files and lists written by "Export List" are both accepted
+    links = []
+    downloaded = set()
+    stream = sys.stdin if path == "-" else open(path, "r", encoding="utf-8")
+    with stream:
+        for line in stream:
+            if not line.strip():
+                continue
+            if line.startswith("\t"):
+                downloaded.add(line.strip())
+            else:
+                links.append(line.strip().split("\t")[0])
+    return links, downloaded
+
+
+def export_format(value):
+    kind, _, extension = value.partition("=")
+    if not kind or extension not in EXPORT_MIME_TYPES:
+        raise argparse.ArgumentTypeError(f"expected TYPE=FORMAT with FORMAT one of: {', '.join(EXPORT_MIME_TYPES)}")
+    return kind, extension
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Download Google Drive folders without the window.")
+    parser.add_argument("links", help='text file with one folder link per line, or "-" to read stdin')
+    parser.add_argument("-o", "--save-path", required=True, help="folder the downloads are saved to")
+    parser.add_argument("--if-exists", choices=["skip", "replace", "rename"], default="skip",
+                        help="what to do when a file is already there (default: skip)")
+    parser.add_argument("-w", "--workers", type=int, default=4, help="files downloaded at the same time (default: 4)")
+    parser.add_argument("--sync", action="store_true", help="only apply Drive changes since the last run")
+    parser.add_argument("--async", dest="use_async", action="store_true",
+                        help="asyncio backend for folders with very many small files (needs aiohttp)")
+    filters = parser.add_argument_group("filters", "mimeType and modifiedTime are evaluated by Drive itself")
+    filters.add_argument("--include", action="append", default=[], metavar="GLOB",
+                         help='only file names matching GLOB, e.g. "*.pdf" (repeatable)')
+    filters.add_argument("--exclude", action="append", default=[], metavar="GLOB",
+                         help="skip files and whole folders whose name matches GLOB (repeatable)")
+    filters.add_argument("--mime-type", action="append", default=[], metavar="TYPE",
+                         help='only this mimeType, "image/*" for a whole family (repeatable)')
+    filters.add_argument("--min-size", type=parse_size, metavar="SIZE", help="e.g. 100K, 5M, 1G")
+    filters.add_argument("--max-size", type=parse_size, metavar="SIZE")
+    filters.add_argument("--modified-after", type=parse_time, metavar="DATE", help="UTC, e.g. 2024-05-01")
+    filters.add_argument("--modified-before", type=parse_time, metavar="DATE")
+    parser.add_argument("--dedupe", choices=DEDUPE_MODES,
+                        help="download files with the same content once and fill the other copies this way")
+    defaults = ", ".join(f"{kind}={extension}" for kind, extension in DEFAULT_EXPORT_FORMATS.items())
+    parser.add_argument("--export", dest="export_formats", type=export_format, action="append", default=[],
+                        metavar="TYPE=FORMAT", help=f"format for Google Docs/Sheets/Slides files (defaults: {defaults})")
+    parser.add_argument("--export-workers", type=int, default=EXPORT_WORKERS,
+                        help=f"Workspace files exported at the same time (default: {EXPORT_WORKERS})")
+    parser.add_argument("--cache-ttl", type=int, default=DEFAULT_TTL, metavar="SECONDS",
+                        help=f"how long a cached folder listing is reused, 0 to always ask Drive (default: {DEFAULT_TTL})")
+    parser.add_argument("--queue", action="store_true",
+                        help="share the job with other processes started on the same save path, on this or other hosts")
+    parser.add_argument("--lease", type=int, default=LEASE_SECONDS, metavar="SECONDS",
+                        help=f"with --queue, how long a silent process keeps its files (default: {LEASE_SECONDS})")
+    parser.add_argument("--stats-file", metavar="PATH",
+                        help=f"write per-endpoint latency, bytes, retries and errors here every {STATS_INTERVAL} s")
+    parser.add_argument("--metrics-port", type=int, metavar="PORT",
+                        help="serve the same numbers to Prometheus at http://127.0.0.1:PORT/metrics")
+    parser.add_argument("--credentials", default="credentials.json", help="service account key file, or a folder of them used in turn")
+    args = parser.parse_args(argv)
+    if args.queue and args.sync:
+        parser.error("--sync cannot be combined with --queue")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    out = sys.stdout
+    try:
+        links, downloaded = read_links(args.links)
+    except OSError as e:
+        print(f"Failed to load links: {e}", file=sys.stderr)
+        return 2
+    if not links:
+        print("No folder links given.", file=sys.stderr)
+        return 2
+
+    # stdout carries only the JSON events, the engine's own log lines go to stderr
+    with redirect_stdout(sys.stderr):
+        app = HeadlessDownloader(out, args.credentials)
+        app.folder_links = links
+        app.downloaded_files = downloaded
+        app.save_dir = args.save_path
+        app.exists_action = args.if_exists
+        app.worker_count = max(1, args.workers)
+        app.sync_enabled = args.sync
+        app.use_async = args.use_async
+        app.export_formats.update(args.export_formats)
+        app.export_workers = max(1, args.export_workers)
+        app.dedupe_mode = args.dedupe
+        app.cache_ttl = max(0, args.cache_ttl)
+        app.queue_mode = args.queue
+        app.lease_seconds = max(10, args.lease)
+        app.stats_file = args.stats_file
+        app.metrics_port = args.metrics_port
+        app.filters = FileFilter(
+            include=args.include, exclude=args.exclude, mime_types=args.mime_type,
+            min_size=args.min_size, max_size=args.max_size,
+            modified_after=args.modified_after, modified_before=args.modified_before,
+        )
+
+        app.downloading = True
+        worker = threading.Thread(target=app.process_links)
+        worker.start()
+        try:
+            while worker.is_alive():
+                worker.join(0.5)
+        except KeyboardInterrupt:
+            # Same as Pause in the window: workers stop after their current chunk and .part files are kept
+            app.downloading = False
+            worker.join()
+            app.emit("summary", counts=dict(app.counts), errors=app.errors, interrupted=True)
+            return 130
+
+    app.emit("summary", counts=dict(app.counts), errors=app.errors, interrupted=False)
+    failed = app.errors or any(app.counts[status] for status in FAILED_STATUSES)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,1230 @@
+import os
+import json
+import queue
+import hashlib
+import threading
+from time import sleep, time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import requests
+from googleapiclient.errors import HttpError
+
+from manifest import DownloadManifest, MANIFEST_NAME
+from listing_cache import DEFAULT_TTL, ListingCache
+from transport import DriveTransport
+from drive_service import build_drive_service
+from credential_pool import CredentialPool
+from progress import ProgressBus, format_progress
+from metrics import STATS_INTERVAL, Metrics, serve_metrics
+from dedupe import content_key, link_file
+from local_index import LocalIndex
+from filters import FileFilter
+from work_queue import LEASE_SECONDS, QUEUE_NAME, WorkQueue
+from rate_limit import MAX_RETRIES, error_reason, is_quota_error, is_retryable
+
+DRIVE_API_ROOT = "https://www.googleapis.com/"  # rootUrl of the Drive discovery document
+FOLDER_MIME_TYPE = "application/vnd.google-apps.folder"
+WORKSPACE_PREFIX = "application/vnd.google-apps."  # Docs, Sheets, Slides and other files with no bytes of their own
+LIST_PAGE_SIZE = 1000  # Largest page size files().list accepts
+CRAWL_WORKERS = 16  # Folders listed at the same time while crawling
+BATCH_SIZE = 100  # Most calls Drive accepts in one batch HTTP request
+PART_SUFFIX = ".part"  # Unfinished downloads are written next to their target with this suffix
+CHECKPOINT_BYTES = 8 * 1024 * 1024  # How often the resume offset of a .part file is saved
+SEGMENT_THRESHOLD = 256 * 1024 * 1024  # Files at least this large are fetched over several connections
+SEGMENT_COUNT = 4  # Connections used for one large file
+VERIFY_RETRIES = 2  # Extra attempts for a file whose bytes do not match its md5Checksum
+LARGE_FILE_BYTES = 64 * 1024 * 1024  # Files at least this large are scheduled as "large"
+QUEUE_POLL = 5  # Seconds between two looks at the shared queue while other processes hold its work
+EXPORT_WORKERS = 2  # Workspace files converted at the same time; export is much slower than a download
+EXPORT_MIME_TYPES = {
+    "docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "pptx": "application/vnd.openxmlformats-officedocument.presentationml.presentation",
+    "odt": "application/vnd.oasis.opendocument.text",
+    "ods": "application/x-vnd.oasis.opendocument.spreadsheet",
+    "odp": "application/vnd.oasis.opendocument.presentation",
+    "pdf": "application/pdf",
+    "txt": "text/plain",
+    "csv": "text/csv",
+    "png": "image/png",
+    "svg": "image/svg+xml",
+}
+DEFAULT_EXPORT_FORMATS = {"document": "docx", "spreadsheet": "xlsx", "presentation": "pptx", "drawing": "pdf"}
+LIST_FIELDS = "nextPageToken, files(id, name, mimeType, size, md5Checksum, modifiedTime)"
+CHANGE_FIELDS = (
+    "nextPageToken, newStartPageToken, "
+    "changes(fileId, removed, file(id, name, mimeType, parents, trashed, size, md5Checksum, modifiedTime))"
+)
+
+
+def split_segments(start, end, count):
+    # [start, end) cut into count [first, last, written] ranges with inclusive ends
+    if end <= start:
+        return []
+    step = -(-(end - start) // count)
+    return [[first, min(first + step, end) - 1, 0] for first in range(start, end, step)]
+
+
+def file_md5(path, length=None):
+    # MD5 object over the first length bytes of path (the whole file when length is None)
+    digest = hashlib.md5()
+    remaining = length
+    with open(path, "rb") as f:
+        while remaining is None or remaining > 0:
+            block = f.read(1024 * 1024 if remaining is None else min(1024 * 1024, remaining))
+            if not block:
+                break
+            digest.update(block)
+            if remaining is not None:
+                remaining -= len(block)
+    return digest
+
+
+def file_record(item, path):
+    # The record the download loop works with, built from a files().list or changes().list item
+    return {
+        "id": item["id"],
+        "name": item["name"],
+        "path": path,
+        "size": item.get("size"),
+        "md5Checksum": item.get("md5Checksum"),
+        "modifiedTime": item.get("modifiedTime"),
+        "mimeType": item.get("mimeType"),
+    }
+
+
+def safe_name(name):
+    # A Drive name as one local path component: Drive names may contain slashes, local ones may not
+    name = name.replace("/", "_").replace("\\", "_")
+    return "_" if name in ("", ".", "..") else name
+
+
+def is_workspace_file(file):
+    return (file.get("mimeType") or "").startswith(WORKSPACE_PREFIX)
+
+
+def file_size(file):
+    return int(file["size"]) if file.get("size") is not None else 0
+
+
+class SizeScheduler:
+    """Work queue that starts large files early and fills the other workers with small ones.
+
+    Up to large_slots workers take the largest remaining file, the rest take the smallest, so
+    the long transfers overlap the many short ones and nobody is left alone with a huge file
+    at the end. Drop-in for queue.Queue in the download workers (get_nowait/put) plus done().
+    """
+
+    def __init__(self, files, worker_count):
+        ordered = sorted(files, key=file_size, reverse=True)
+        self.large = deque(file for file in ordered if file_size(file) >= LARGE_FILE_BYTES)
+        self.small = deque(reversed([file for file in ordered if file_size(file) < LARGE_FILE_BYTES]))
+        self.large_slots = max(1, worker_count // 2)
+        self.active_large = 0
+        self.lock = threading.Lock()
+
+    def get_nowait(self):
+        with self.lock:
+            take_large = self.large and (self.active_large < self.large_slots or not self.small)
+            if take_large:
+                self.active_large += 1
+                return self.large.popleft()
+            if self.small:
+                return self.small.popleft()
+        raise queue.Empty
+
+    def put(self, file):
+        # Retries go to the back of their lane
+        with self.lock:
+            (self.large if file_size(file) >= LARGE_FILE_BYTES else self.small).append(file)
+
+    def done(self, file):
+        if file_size(file) >= LARGE_FILE_BYTES:
+            with self.lock:
+                self.active_large -= 1
+
+
+class DriveDownloader:
+    """Crawl and download engine shared by the Tk window and the command line.
+
+    Front ends fill in the settings below, call process_links and override the
+    set_status/show_error/file_finished/report_progress hooks to report progress their own way.
+    """
+
+    def __init__(self, credentials_file="credentials.json"):
+        self.credentials_file = credentials_file
+        self.api_root = DRIVE_API_ROOT  # Any server speaking Drive v3, e.g. benchmarks/fake_drive.py
+        self.accounts = None  # CredentialPool of credentials_file, a key or a folder of keys; loaded on first use
+        self.drive_service = None
+        self.service_lock = threading.Lock()
+        self.folder_links = []
+        self.downloading = False
+        self.file_list = []
+        self.downloaded_files = set()  # "path/name" entries imported from a list, treated as downloaded
+        self.manifest = None  # DownloadManifest of the current save path
+        self.lock = threading.Lock()  # Guards claimed_paths across workers
+        self.claimed_paths = set()  # Local paths already handed to a worker in this run
+        self.local_index = LocalIndex()  # What is already in the save path, listed once per run and directory
+        self.rename_counters = {}  # (directory, base name, extension) -> next "name (n)" to try
+        self.transport = None  # Pooled HTTP session for media downloads, sized to the worker count
+        self.metrics = Metrics()  # Latency, bytes, retries and status codes of every call, across runs
+        self.segment_threshold = SEGMENT_THRESHOLD
+        self.segment_count = SEGMENT_COUNT
+        self.listing_cache = ListingCache()  # Folder listings shared by download, export, resume and later runs
+        self.progress = ProgressBus()  # Workers bump its counters, it reports at a fixed rate
+        self.progress.subscribe(self.report_progress)
+        self.progress.subscribe(self.write_stats)
+        self.metrics_server = None
+        self.stats_written = 0.0
+        self.duplicates = {}  # File id -> other pending files with the same bytes, filled in once it is done
+
+        # Settings for the next run
+        self.save_dir = ""
+        self.exists_action = "skip"  # "skip", "replace" or "rename"
+        self.worker_count = 4
+        self.sync_enabled = False
+        self.use_async = False
+        self.export_workers = EXPORT_WORKERS
+        self.export_formats = dict(DEFAULT_EXPORT_FORMATS)  # Workspace type ("document", ...) -> extension
+        self.dedupe_mode = None  # "hardlink", "reflink" or "copy" to fetch identical files only once
+        self.filters = FileFilter()  # Keeps everything unless configured
+        self.queue_mode = False  # Share the job with other processes through a work queue in the save path
+        self.lease_seconds = LEASE_SECONDS
+        self.work_queue = None  # WorkQueue of the current run in queue mode
+        self.leased_ids = set()  # Files leased by this process and not finished yet
+        self.stats_file = None  # JSON file the metrics are written to every STATS_INTERVAL seconds
+        self.metrics_port = None  # Serve the metrics to Prometheus on 127.0.0.1 at this port
+        self.cache_ttl = DEFAULT_TTL  # Seconds a cached folder listing is used without asking Drive; 0 turns it off
+
+    def set_status(self, text, color="blue"):
+        print(text)
+
+    def show_error(self, message):
+        print(f"Error: {message}")
+
+    def file_finished(self, file, status, local_path):
+        pass  # Called once per file with its final status for this run
+
+    def report_progress(self, snapshot):
+        # Called from the progress thread every PROGRESS_INTERVAL seconds while a run is going
+        print(format_progress(snapshot), end="\r")
+
+    @property
+    def service(self):
+        if self.drive_service is None:
+            self.initialize_drive_service()
+        return self.drive_service
+
+    def initialize_drive_service(self):
+        # Built the first time a call needs it, so the window and the CLI start without touching Drive
+        credentials = self.load_accounts().primary.credentials  # Each call is then sent as the account in turn
+        with self.service_lock:
+            if self.drive_service is None:
+                self.drive_service = build_drive_service(credentials, self.api_root)
+        return self.drive_service
+
+    @property
+    def files_url(self):
+        return f"{self.api_root}drive/v3/files"
+
+    def load_accounts(self):
+        # Every account paces itself against its own quota, so several keys add up their rates
+        with self.service_lock:
+            if self.accounts is None:
+                self.accounts = CredentialPool.from_path(self.credentials_file, self.metrics)
+        return self.accounts
+
+    def open_manifest(self):
+        if self.manifest is None or (self.manifest.save_dir, self.manifest.shared) != (self.save_dir, self.queue_mode):
+            if self.manifest:
+                self.manifest.close()
+            self.manifest = DownloadManifest(self.save_dir, shared=self.queue_mode)
+        return self.manifest
+
+    def open_work_queue(self):
+        if not self.queue_mode:
+            return None
+        if self.work_queue is None or self.work_queue.path != os.path.join(self.save_dir, QUEUE_NAME):
+            if self.work_queue:
+                self.work_queue.close()
+            self.work_queue = WorkQueue(self.save_dir, self.lease_seconds)
+        return self.work_queue
+
+    def open_backend(self):
+        # The app itself runs the threaded loops; the asyncio backend is only loaded when selected
+        if not self.use_async:
+            return self
+        try:
+            from async_backend import AsyncBackend
+            return AsyncBackend(self)
+        except RuntimeError as e:
+            self.downloading = False
+            self.show_error(str(e))
+            self.set_status("Status: Waiting to start...", "blue")
+            return None
+
+    def open_transport(self):
+        # Every worker may be fetching all segments of a large file at once
+        pool_size = self.worker_count * max(1, self.segment_count) + self.export_workers
+        if self.transport is None or self.transport.pool_size != pool_size:
+            if self.transport:
+                self.transport.close()
+            self.transport = DriveTransport(self.load_accounts(), pool_size=pool_size, metrics=self.metrics)
+        return self.transport
+
+    def open_metrics_server(self):
+        # Started once and kept between runs, a scraper sees one series for the life of the process
+        if not self.metrics_port or self.metrics_server:
+            return
+        try:
+            self.metrics_server = serve_metrics(self.metrics, self.metrics_port, lambda: self.progress.latest)
+        except OSError as e:
+            self.show_error(f"Could not serve metrics on port {self.metrics_port}: {e}")
+
+    def write_stats(self, snapshot, force=False):
+        # Progress subscriber: the stats file is rewritten every STATS_INTERVAL seconds and at the end of a run
+        if not self.stats_file or (not force and time() - self.stats_written < STATS_INTERVAL):
+            return
+        self.stats_written = time()
+        try:
+            self.metrics.write_json(self.stats_file, snapshot)
+        except OSError as e:
+            print(f"Could not write stats to {self.stats_file}: {e}")
+
+    def existing_manifest(self, save_dir):
+        # Reuse the open manifest, or read one left in the save path by an earlier run
+        if self.manifest and self.manifest.save_dir == save_dir:
+            return self.manifest
+        if save_dir and os.path.exists(os.path.join(save_dir, MANIFEST_NAME)):
+            return DownloadManifest(save_dir)
+        return None
+
+    def extract_folder_id(self, folder_link):
+        try:
+            if "folders" in folder_link:
+                return folder_link.split("/folders/")[1].split("?")[0]
+            return folder_link.split("/")[-1].split("?")[0]
+        except IndexError:
+            return None
+
+    def get_folder_names(self, folder_ids):
+        # Look names up BATCH_SIZE at a time in one batch HTTP request instead of one files().get each.
+        # Returns ({folder_id: name}, {folder_id: error}) so failures can be traced back to their link.
+        folder_names = {}
+        errors = {}
+        throttled = []  # Ids to ask again in the next round
+        quota_errors = []
+
+        def callback(request_id, response, exception):
+            if isinstance(exception, HttpError):
+                status, reason = int(exception.resp.status), error_reason(exception.content)
+                if is_retryable(status, reason):
+                    throttled.append(request_id)
+                    if is_quota_error(status, reason):
+                        quota_errors.append(request_id)
+            if exception is not None:
+                errors[request_id] = exception
+            else:
+                folder_names[request_id] = response.get("name")
+                errors.pop(request_id, None)
+
+        pending_ids = list(dict.fromkeys(folder_ids))  # Request ids must be unique within a batch
+        accounts = self.load_accounts()
+        account = accounts.take()
+        for attempt in range(MAX_RETRIES + 1):
+            for start in range(0, len(pending_ids), BATCH_SIZE):
+                chunk = pending_ids[start:start + BATCH_SIZE]
+                batch = self.service.new_batch_http_request(callback=callback)
+                for folder_id in chunk:
+                    batch.add(self.service.files().get(fileId=folder_id, fields="name"), request_id=folder_id)
+                try:
+                    # Every call inside a batch counts against the quota on its own
+                    accounts.execute(batch, tokens=len(chunk), account=account)
+                except Exception as e:
+                    for folder_id in chunk:
+                        errors.setdefault(folder_id, e)  # The whole batch failed, blame every link in it
+
+            if not throttled:
+                break
+            quota = bool(quota_errors)
+            pending_ids = list(throttled)
+            throttled.clear()
+            quota_errors.clear()
+            if attempt < MAX_RETRIES:
+                sleep(accounts.backoff(account, attempt, quota=quota))
+                account = accounts.take()  # Another one when this account was put to rest
+        return folder_names, errors
+
+    def process_links(self):
+        self.open_metrics_server()
+        self.progress.start()
+        try:
+            with self.lock:
+                self.claimed_paths = set()
+                self.duplicates = {}
+                self.local_index = LocalIndex()  # Files may have changed on disk since the last run
+                self.rename_counters = {}
+            self.listing_cache.set_ttl(self.cache_ttl)
+            manifest = self.open_manifest()
+            work_queue = self.open_work_queue()
+            self.open_transport()
+            backend = self.open_backend()
+            if backend is None:
+                return
+
+            folder_ids = {link: self.extract_folder_id(link) for link in self.folder_links}
+            folder_names, errors = self.get_folder_names([fid for fid in folder_ids.values() if fid])
+
+            root_ids = [fid for fid in dict.fromkeys(folder_ids.values()) if fid in folder_names]
+            # Other processes of a shared job cannot see local changes made here, so sync is left to single runs
+            synced = self.sync_enabled and not work_queue and self.sync_changes(manifest, root_ids)
+
+            for folder_link in self.folder_links:
+                if not self.downloading:
+                    break
+
+                folder_id = folder_ids[folder_link]
+                if not folder_id:
+                    self.show_error(f"Invalid folder link: {folder_link}")
+                    continue
+
+                folder_name = folder_names.get(folder_id)
+                if not folder_name:
+                    reason = f"\n{errors[folder_id]}" if folder_id in errors else ""
+                    self.show_error(f"Failed to fetch folder name for: {folder_link}{reason}")
+                    continue
+
+                folder_name = safe_name(folder_name)
+                target_path = os.path.join(self.save_dir, folder_name)
+                os.makedirs(target_path, exist_ok=True)
+
+                if work_queue:
+                    self.download_shared(manifest, work_queue, backend, folder_id, folder_name, folder_link)
+                    continue
+
+                # An unfinished job is picked up from the manifest instead of crawling the tree again
+                if not (synced or manifest.has_unfinished_job(folder_id, self.filters.signature())):
+                    if not self.crawl_root(manifest, backend, folder_id, folder_name, folder_link):
+                        continue
+
+                # Filters are checked again here, sync mode may have moved known files out of them
+                self.file_list = [file for file in manifest.pending_files(folder_id) if self.filters.matches(file)]
+                if not self.file_list:
+                    self.set_status(f"All files of {folder_name} are already downloaded.", "green")
+                    continue
+
+                total = manifest.count_files(folder_id)
+                self.set_status(f"Found {total} files, {len(self.file_list)} to download. Starting download...", "green")
+                self.progress.add_work(self.file_list)
+
+                backend.download_files(self.group_duplicates(self.file_list))
+
+            self.set_status("Download completed!" if self.downloading else "Paused.", "blue")
+            self.downloading = False
+        except Exception as e:
+            self.show_error(f"An error occurred: {str(e)}")
+            self.set_status("Error downloading files.", "red")
+        finally:
+            if self.work_queue:
+                self.work_queue.stop_heartbeat()
+            self.progress.stop()
+            self.write_stats(self.progress.latest, force=True)
+
+    def crawl_root(self, manifest, backend, folder_id, folder_name, folder_link):
+        # Sync mode builds on the page token, which only holds for a listing made after it was taken.
+        # Sync runs therefore ask Drive for every folder; other runs may use the cache and save no token.
+        fresh = self.sync_enabled or not self.cache_ttl
+        page_token = self.start_page_token() if fresh else None  # Taken first so no change slips through
+        folders = {}
+        errors = {}
+        listing = backend.fetch_all_files(
+            folder_id, current_path=folder_name, folders=folders, errors=errors, fresh=fresh
+        )
+        self.report_listing_errors(errors)
+        if not listing:
+            self.show_error(f"No files found in folder: {folder_link}")
+            return False
+        manifest.save_listing(
+            folder_id, folder_name, listing, folders, page_token, complete=not errors, filters=self.filters.signature()
+        )
+        return True
+
+    def download_shared(self, manifest, work_queue, backend, folder_id, folder_name, folder_link):
+        # Queue mode: one process lists the root, then every process leases files in small batches
+        # until none are left, also picking up the leases of processes that died.
+        work_queue.start_heartbeat()
+        joined = time()
+        while self.downloading:
+            claim = work_queue.claim_crawl(folder_id, joined)
+            if claim == "crawl":
+                if manifest.has_unfinished_job(folder_id, self.filters.signature()) or self.crawl_root(
+                    manifest, backend, folder_id, folder_name, folder_link
+                ):
+                    work_queue.add(folder_id, [f for f in manifest.pending_files(folder_id) if self.filters.matches(f)])
+                else:
+                    work_queue.add(folder_id, [])  # Nothing to do, let the others move on
+                break
+            if claim == "ready":
+                break
+            self.set_status(f"Waiting for another process to list {folder_name}...", "green")
+            sleep(QUEUE_POLL)
+
+        while self.downloading:
+            files = work_queue.lease(folder_id, self.worker_count * 4)
+            if not files:
+                if not work_queue.unfinished(folder_id):
+                    break
+                sleep(QUEUE_POLL)  # The rest is leased by others; it comes back here if they stop renewing
+                continue
+
+            self.set_status(f"Leased {len(files)} files of {folder_name}.", "green")
+            self.progress.add_work(files)
+            with self.lock:
+                self.leased_ids = {file["id"] for file in files}
+            backend.download_files(self.group_duplicates(files))
+            with self.lock:
+                unfinished, self.leased_ids = self.leased_ids, set()
+            work_queue.release(unfinished)  # Paused before they started
+
+    def fetch_all_files(self, folder_id, current_path="", folders=None, errors=None, fresh=False):
+        # Breadth-first crawl: every known folder is listed in parallel, one level after another.
+        # When a dict is passed as folders it is filled with {folder_id: path} for the whole tree,
+        # one passed as errors with {path: exception} for every folder that could not be listed.
+        # fresh skips the listing cache, its listings are still stored for later runs.
+        all_files = []
+        if folders is not None:
+            folders[folder_id] = current_path
+        with ThreadPoolExecutor(max_workers=CRAWL_WORKERS) as pool:
+            # Root is trusted for the TTL only, it has no parent listing to compare modifiedTime with
+            pending = {pool.submit(self.list_folder, folder_id, None, fresh): current_path}
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    path = pending.pop(future)
+                    try:
+                        items = future.result()
+                    except Exception as e:
+                        print(f"Error fetching file list for {path or folder_id}: {e}")
+                        if errors is not None:
+                            errors[path or folder_id] = e
+                        continue
+
+                    for item in items:
+                        if item["mimeType"] == FOLDER_MIME_TYPE:
+                            if not self.filters.walks(item["name"]):
+                                continue  # Excluded subtree, never listed
+                            subfolder_path = os.path.join(path, safe_name(item["name"]))
+                            future = pool.submit(self.list_folder, item["id"], item.get("modifiedTime"), fresh)
+                            pending[future] = subfolder_path
+                            if folders is not None:
+                                folders[item["id"]] = subfolder_path
+                        elif self.filters.matches(item):
+                            all_files.append(file_record(item, path))
+
+        return all_files
+
+    def report_listing_errors(self, errors):
+        # One show_error per crawl, so the window shows one box and the command line exits with 1
+        if not errors:
+            return
+        lines = [f"{path}: {error}" for path, error in list(errors.items())[:10]]
+        if len(errors) > 10:
+            lines.append(f"... and {len(errors) - 10} more")
+        message = f"Failed to list {len(errors)} folder(s), their files are left out of this run:"
+        self.show_error("\n".join([message] + lines))
+
+    def listing_query(self, folder_id):
+        # Children of folder_id, narrowed by the filters Drive can evaluate itself
+        return f"'{folder_id}' in parents and trashed=false{self.filters.query()}"
+
+    def listing_key(self, folder_id):
+        query = self.filters.query()
+        return f"{folder_id} {query.strip()}" if query else folder_id
+
+    def list_folder(self, folder_id, modified_time=None, fresh=False):
+        # Served from the listing cache unless it expired, the folder's modifiedTime moved on or fresh is set
+        items = None if fresh else self.listing_cache.get(self.listing_key(folder_id), modified_time)
+        if items is not None:
+            return items
+
+        # Follow nextPageToken so folders larger than one page are listed completely
+        items = []
+        page_token = None
+        while True:
+            request = self.service.files().list(
+                q=self.listing_query(folder_id),
+                fields=LIST_FIELDS,
+                pageSize=LIST_PAGE_SIZE,
+                pageToken=page_token,
+            )
+            results = self.load_accounts().execute(request)
+
+            items.extend(results.get("files", []))
+            page_token = results.get("nextPageToken")
+            if not page_token:
+                self.listing_cache.put(self.listing_key(folder_id), items, modified_time)
+                return items
+
+    def start_page_token(self):
+        try:
+            request = self.service.changes().getStartPageToken()
+            # Page tokens of the changes feed belong to one account, always the primary one
+            return self.load_accounts().execute(request, account=self.accounts.primary)["startPageToken"]
+        except Exception as e:
+            print(f"Error fetching changes start token: {e}")
+            return None
+
+    def sync_changes(self, manifest, root_ids):
+        # Bring the manifest up to date from the changes feed; False means the folders must be crawled
+        page_tokens = manifest.page_tokens(root_ids, self.filters.signature())
+        if not root_ids or len(page_tokens) < len(root_ids):
+            return False  # Some folder was never fully listed, or was listed with other filters
+
+        # Replaying a change twice is harmless, so starting at the oldest token covers every root
+        page_token = min(page_tokens.values(), key=lambda token: (len(token), token))
+        changes = []
+        new_start_token = None
+        try:
+            while page_token:
+                request = self.service.changes().list(
+                    pageToken=page_token,
+                    pageSize=LIST_PAGE_SIZE,
+                    includeRemoved=True,
+                    spaces="drive",
+                    fields=CHANGE_FIELDS,
+                )
+                results = self.load_accounts().execute(request, account=self.accounts.primary)
+                changes.extend(results.get("changes", []))
+                page_token = results.get("nextPageToken")
+                new_start_token = results.get("newStartPageToken", new_start_token)
+        except Exception as e:
+            print(f"Error fetching changes, listing folders again instead: {e}")
+            return False
+
+        self.set_status(f"Applying {len(changes)} changes...", "green")
+        # Cached listings of every folder touched by a change are out of date now
+        touched = set()
+        for change in changes:
+            touched.add(change["fileId"])
+            touched.update((change.get("file") or {}).get("parents") or [])
+        self.listing_cache.invalidate(touched)
+        self.apply_changes(manifest, changes, set(root_ids))
+        manifest.set_page_token(root_ids, new_start_token)
+        return True
+
+    def apply_changes(self, manifest, changes, root_ids):
+        folder_changes = []
+        file_changes = []
+        for change in changes:
+            if change["fileId"] in root_ids:
+                continue  # The linked folders themselves are resolved by name on every run
+            item = change.get("file") or {}
+            if item.get("mimeType") == FOLDER_MIME_TYPE or (
+                change.get("removed") and manifest.get_folder(change["fileId"])
+            ):
+                folder_changes.append(change)
+            else:
+                file_changes.append(change)
+
+        # Folders go first so files land under their current paths. A folder whose parent is
+        # created or moved later in the feed is retried until no more folders can be placed.
+        remaining = folder_changes
+        while remaining:
+            unresolved = [change for change in remaining if not self.apply_folder_change(manifest, change)]
+            if len(unresolved) == len(remaining):
+                break
+            remaining = unresolved
+        for change in remaining:
+            self.apply_folder_change(manifest, change, final=True)
+
+        for change in file_changes:
+            self.apply_file_change(manifest, change)
+
+    def apply_folder_change(self, manifest, change, final=False):
+        # Returns False when the folder's parent is not known yet
+        folder_id = change["fileId"]
+        item = change.get("file") or {}
+        known = manifest.get_folder(folder_id)
+        gone = change.get("removed") or item.get("trashed")
+        parent = None if gone else manifest.get_folder((item.get("parents") or [None])[0])
+
+        if parent is None and not gone and not final:
+            return False
+        if parent is None:
+            # Trashed, removed or moved out of every tracked folder
+            if known:
+                for record in manifest.remove_folder(folder_id):
+                    self.delete_local(record)
+                self.prune_empty_dirs(os.path.join(self.save_dir, known[1]))
+            return True
+
+        root_id, parent_path = parent
+        new_path = os.path.join(parent_path, safe_name(item["name"]))
+        if known and known[0] == root_id:
+            if known[1] != new_path:
+                old_dir = os.path.join(self.save_dir, known[1])
+                new_dir = os.path.join(self.save_dir, new_path)
+                if os.path.exists(old_dir) and not os.path.exists(new_dir):
+                    os.renames(old_dir, new_dir)
+                    manifest.move_folder(folder_id, new_path)
+                    return True
+            else:
+                return True
+
+        # New folder, or one that could not be moved locally: forget the old copy and list it again
+        if known:
+            for record in manifest.remove_folder(folder_id):
+                self.delete_local(record)
+        folders = {}
+        errors = {}
+        # Cached listings of the folders below it may predate the changes just read
+        files = self.fetch_all_files(folder_id, current_path=new_path, folders=folders, errors=errors, fresh=True)
+        self.report_listing_errors(errors)
+        manifest.add_files(root_id, files, folders)
+        if errors:
+            manifest.mark_incomplete(root_id)  # The next run lists the whole root again
+        return True
+
+    def apply_file_change(self, manifest, change):
+        file_id = change["fileId"]
+        item = change.get("file") or {}
+        known = manifest.get_file(file_id)
+        gone = change.get("removed") or item.get("trashed")
+        parent = None if gone else manifest.get_folder((item.get("parents") or [None])[0])
+
+        if parent is None:
+            if known:
+                self.delete_local(known)
+                manifest.remove_file(file_id)
+            return
+
+        root_id, path = parent
+        record = file_record(item, path)
+        if not known and not self.filters.matches(record):
+            return  # Not part of this job
+        if known and known["localPath"]:
+            moved = (known["path"], known["name"]) != (path, record["name"])
+            same_content = (known["md5Checksum"], known["modifiedTime"]) == (
+                record["md5Checksum"], record["modifiedTime"]
+            )
+            target = os.path.join(self.save_dir, path, self.local_name(record))
+            if moved and same_content and os.path.exists(known["localPath"]) and not os.path.exists(target):
+                os.renames(known["localPath"], target)  # Moved or renamed only, keep the bytes we have
+                manifest.add_files(root_id, [record])
+                manifest.mark(record, "done", target)
+                return
+            if moved or not same_content:
+                self.delete_local(known)  # Replaced by a fresh download below
+                manifest.add_files(root_id, [record])
+                manifest.mark(record, "pending")
+                return
+        manifest.add_files(root_id, [record])
+
+    def delete_local(self, record):
+        path = record.get("localPath")
+        if not path:
+            return
+        for stale in (path, path + PART_SUFFIX, path + PART_SUFFIX + ".json"):
+            try:
+                os.remove(stale)
+            except FileNotFoundError:
+                pass
+        self.prune_empty_dirs(os.path.dirname(path))
+
+    def prune_empty_dirs(self, directory):
+        # Remove directory and its parents while they are empty, never going above the save path
+        save_dir = os.path.abspath(self.save_dir)
+        directory = os.path.abspath(directory)
+        for current, _, _ in sorted(os.walk(directory), key=lambda entry: len(entry[0]), reverse=True):
+            if not os.listdir(current):
+                os.rmdir(current)
+        while directory.startswith(save_dir + os.sep):
+            if os.path.isdir(directory):
+                if os.listdir(directory):
+                    break
+                os.rmdir(directory)
+            directory = os.path.dirname(directory)
+
+    def download_files(self, files):
+        # Workspace files are exported by their own, smaller pool next to the download workers
+        downloads = [file for file in files if not is_workspace_file(file)]
+        exporter = threading.Thread(
+            target=self.export_files, args=([file for file in files if is_workspace_file(file)],), daemon=True
+        )
+        exporter.start()
+        work = SizeScheduler(downloads, self.worker_count)
+
+        workers = [
+            threading.Thread(target=self.download_worker, args=(work,), daemon=True)
+            for _ in range(min(self.worker_count, len(downloads)))
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()  # Workers return on their own once the queue is empty or paused
+        exporter.join()
+
+    def download_worker(self, work):
+        while self.downloading:
+            try:
+                file = work.get_nowait()
+            except queue.Empty:
+                return
+            if self.skip_imported(file):
+                work.done(file)
+                continue
+
+            try:
+                status, full_path = self.download_file(file, os.path.join(self.save_dir, file['path']))
+            except Exception as e:
+                # Disk full, no permission, a name the filesystem refuses: this file fails, the worker goes on
+                self.show_error(f"Failed to download {file['path']}/{file['name']}: {e}")
+                status, full_path = "failed", None
+            finally:
+                work.done(file)
+            if status == "corrupt":
+                if file.get("attempts", 0) < VERIFY_RETRIES:
+                    file["attempts"] = file.get("attempts", 0) + 1
+                    with self.lock:
+                        self.claimed_paths.discard(full_path)
+                    work.put(file)  # Retry queue: the file goes back to the end of the line
+                    continue
+                status = "failed"
+            self.record_result(file, status, full_path)
+
+    def skip_imported(self, file):
+        # Files listed as downloaded in an imported list are recorded as skipped, so the manifest
+        # does not keep them pending and resume the job on every run
+        if f"{file['path']}/{file['name']}" not in self.downloaded_files:
+            return False
+        self.record_result(file, "skipped", os.path.join(self.save_dir, file["path"], self.local_name(file)))
+        return True
+
+    def record_result(self, file, status, full_path):
+        self.manifest.mark(file, status, full_path)
+        if self.work_queue and file["id"] in self.leased_ids:
+            with self.lock:
+                self.leased_ids.discard(file["id"])
+            self.work_queue.complete(file["id"], status)
+        if status == "done":
+            self.local_index.add(full_path, int(file["size"]) if file.get("size") is not None else None)
+        self.progress.finish_file(file)
+        self.file_finished(file, status, full_path)
+
+        with self.lock:
+            duplicates = self.duplicates.pop(file["id"], None)
+        if not duplicates:
+            return
+        if status in ("done", "skipped") and full_path and os.path.isfile(full_path):
+            self.link_duplicates(full_path, duplicates)
+        else:
+            for duplicate in duplicates:
+                self.record_result(duplicate, status, None)  # Pending again, retried with their copy next run
+
+    def group_duplicates(self, files):
+        # Files sharing md5Checksum and size are downloaded once. Content already on disk from an earlier
+        # run or another folder is linked right away, otherwise one copy is fetched and the rest wait for it.
+        if not self.dedupe_mode:
+            return files
+        groups = {}
+        unique = []
+        for file in files:
+            key = content_key(file)
+            if key is None or f"{file['path']}/{file['name']}" in self.downloaded_files:
+                unique.append(file)
+            else:
+                groups.setdefault(key, []).append(file)
+
+        for (md5, size), group in groups.items():
+            source = self.manifest.find_content(md5, size)
+            if source:
+                self.link_duplicates(source, group)
+                continue
+            unique.append(group[0])
+            if len(group) > 1:
+                with self.lock:
+                    self.duplicates[group[0]["id"]] = group[1:]
+        return unique
+
+    def link_duplicates(self, source, files):
+        for file in files:
+            output_dir = os.path.join(self.save_dir, file["path"])
+            full_path = self.get_filename(output_dir, self.local_name(file), file.get("size"), file["id"])
+            if not full_path:
+                self.record_result(file, "skipped", os.path.join(output_dir, self.local_name(file)))
+                continue
+            if full_path == source:
+                self.record_result(file, "done", full_path)
+                continue
+            os.makedirs(output_dir, exist_ok=True)
+            try:
+                how = link_file(source, full_path, self.dedupe_mode)
+            except OSError as e:
+                print(f"Failed to copy {file['name']} from {source}: {e}")
+                self.record_result(file, "failed", full_path)
+                continue
+            print(f"{file['name']} is a {how} of {source}, not downloaded again.")
+            self.record_result(file, "done", full_path)
+
+    def export_files(self, files):
+        work = queue.Queue()
+        for file in files:
+            work.put(file)
+        workers = [
+            threading.Thread(target=self.export_worker, args=(work,), daemon=True)
+            for _ in range(min(self.export_workers, len(files)))
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+    def export_worker(self, work):
+        while self.downloading:
+            try:
+                file = work.get_nowait()
+            except queue.Empty:
+                return
+            if self.skip_imported(file):
+                continue
+            try:
+                status, full_path = self.export_file(file, os.path.join(self.save_dir, file["path"]))
+            except Exception as e:
+                self.show_error(f"Failed to export {file['path']}/{file['name']}: {e}")
+                status, full_path = "failed", None
+            self.record_result(file, status, full_path)
+
+    def export_format(self, file):
+        # Extension a Workspace file is exported to, or None when there is no format for its type
+        if not is_workspace_file(file):
+            return None
+        return self.export_formats.get(file["mimeType"][len(WORKSPACE_PREFIX):])
+
+    def local_name(self, file):
+        name = safe_name(file["name"])
+        extension = self.export_format(file)
+        if extension and not name.lower().endswith("." + extension):
+            return f"{name}.{extension}"
+        return name
+
+    def export_file(self, file, output_dir):
+        # files.export converts a Workspace file on the fly; there is no md5Checksum to verify it against.
+        # An unchanged export is never requested again: the manifest keeps it done until modifiedTime moves,
+        # then it is exported again over its old copy.
+        file_name = file["name"]
+        extension = self.export_format(file)
+        if not extension:
+            print(f"Skipping {file_name}: {file['mimeType']} cannot be exported.")
+            return "skipped", None
+
+        full_path = self.changed_export_path(file, output_dir) or self.get_filename(
+            output_dir, self.local_name(file), file_id=file["id"]
+        )
+        if not full_path:
+            return "skipped", os.path.join(output_dir, self.local_name(file))
+
+        os.makedirs(output_dir, exist_ok=True)
+        part_path = full_path + PART_SUFFIX
+        url = f"{self.files_url}/{file['id']}/export"
+        try:
+            with self.transport.get(url, params={"mimeType": EXPORT_MIME_TYPES[extension]}, stream=True) as response:
+                if response.status_code >= 400:
+                    # exportSizeLimitExceeded: Drive only exports files of up to 10 MB
+                    reason = error_reason(response.content) or response.status_code
+                    print(f"Failed to export {file_name}: {reason}")
+                    return "failed", full_path
+                with open(part_path, "wb") as f, self.progress.transfer(file_name, None) as transfer:
+                    for block in self.transport.iter_blocks(response):
+                        if not self.downloading:
+                            break
+                        self.metrics.write(f, block)
+                        transfer.advance(len(block))
+        except requests.exceptions.RequestException as e:
+            print(f"Failed to export {file_name}: {e}")
+            self.discard_partial(part_path)
+            return "failed", full_path
+
+        if not self.downloading:
+            self.discard_partial(part_path)  # Exports are small, the next run starts them over
+            return "partial", full_path
+        os.replace(part_path, full_path)
+        print(f"Exported {file_name} as {extension}.")
+        return "done", full_path
+
+    def changed_export_path(self, file, output_dir):
+        # Path of an earlier export of this file when the doc changed since, as long as it is still
+        # in the right folder with the right extension; skip mode would otherwise keep the old copy
+        path = file.get("localPath")
+        if file.get("status") != "pending" or not path:
+            return None
+        base_name, ext = os.path.splitext(self.local_name(file))
+        name = os.path.basename(path)
+        if os.path.abspath(os.path.dirname(path)) != os.path.abspath(output_dir) or not (
+            name == base_name + ext or (name.startswith(base_name + " (") and name.endswith(")" + ext))
+        ):
+            return None  # Renamed, moved or exported to another format: a new path is picked
+        with self.lock:
+            if self.is_claimed(path, file["id"]):
+                return None
+            self.claimed_paths.add(path)
+        return path
+
+    def download_file(self, file, output_dir):
+        # Returns (status, local path) with status one of "done", "skipped", "failed", "partial" or "corrupt"
+        file_id, file_name = file["id"], file["name"]
+        url = f"{self.files_url}/{file_id}?alt=media"
+        headers = {}
+
+        local_name = self.local_name(file)
+        full_path = self.resume_path(file) or self.get_filename(output_dir, local_name, file.get("size"), file_id)
+        if not full_path:
+            return "skipped", os.path.join(output_dir, local_name)  # Skip if no download needed
+
+        os.makedirs(output_dir, exist_ok=True)  # Ensure directory exists
+        size = int(file["size"]) if file.get("size") is not None else None
+        if size is not None and self.segment_count > 1 and size >= self.segment_threshold:
+            return self.download_segmented(file, url, full_path, size)
+
+        part_path = full_path + PART_SUFFIX
+        offset = self.partial_offset(part_path, file)
+        if offset:
+            headers["Range"] = f"bytes={offset}-"  # Only fetch the bytes that are still missing
+
+        try:
+            with self.transport.get(url, headers=headers, stream=True) as response:
+                if offset and response.status_code == 416:
+                    self.discard_partial(part_path)  # Stale offset, start over on the next attempt
+                response.raise_for_status()
+                if response.status_code != 206:
+                    offset = 0  # Range was ignored, the whole file is coming
+                total_size = offset + int(response.headers.get('content-length', 0))
+                expected_size = int(file["size"]) if file.get("size") is not None else total_size
+                downloaded = offset
+                # MD5 is updated as chunks arrive; only bytes kept from an earlier attempt are read back
+                digest = file_md5(part_path, offset) if offset else hashlib.md5()
+
+                with open(part_path, "r+b" if offset else "wb") as f, \
+                        self.progress.transfer(file_name, expected_size, offset) as transfer:
+                    f.seek(offset)
+                    f.truncate()
+                    checkpoint = downloaded
+                    try:
+                        for block in self.transport.iter_blocks(response):
+                            if not self.downloading:
+                                break
+                            self.metrics.write(f, block)
+                            digest.update(block)
+                            downloaded += len(block)
+                            transfer.advance(len(block))
+                            if downloaded - checkpoint >= CHECKPOINT_BYTES:
+                                f.flush()
+                                self.save_partial_state(part_path, file, offset=downloaded)
+                                checkpoint = downloaded
+                    finally:
+                        f.flush()
+                        self.save_partial_state(part_path, file, offset=downloaded)
+
+                if not self.downloading:
+                    return "partial", full_path  # Paused mid-file, the .part file is resumed later
+
+            if downloaded < expected_size:
+                print(f"Incomplete download of {file_name}: {downloaded} of {expected_size} bytes.")
+                return "partial", full_path
+            if downloaded > expected_size:
+                print(f"Size mismatch for {file_name}: got {downloaded} bytes, expected {expected_size}.")
+                self.discard_partial(part_path)
+                return "failed", full_path
+            if file.get("md5Checksum") and digest.hexdigest() != file["md5Checksum"]:
+                print(f"Checksum mismatch for {file_name}, queued for another attempt.")
+                self.discard_partial(part_path)
+                return "corrupt", full_path
+
+            os.replace(part_path, full_path)
+            os.remove(part_path + ".json")
+            print(f"Downloaded {file_name} successfully.")
+            return "done", full_path
+        except requests.exceptions.RequestException as e:
+            print(f"Failed to download {file_name}: {e}")
+            return ("partial" if os.path.exists(part_path) else "failed"), full_path
+
+    def download_segmented(self, file, url, full_path, size):
+        # Byte ranges of one large file are fetched in parallel, each written at its own offset
+        file_name = file["name"]
+        part_path = full_path + PART_SUFFIX
+        segments = self.partial_segments(part_path, file, size)
+        if segments is None:
+            segments = split_segments(0, size, self.segment_count)
+            with open(part_path, "wb") as f:
+                f.truncate(size)  # Preallocate so every segment can write in place
+        else:
+            with open(part_path, "r+b") as f:
+                f.truncate(size)
+
+        state_lock = threading.Lock()
+
+        def save_state():
+            with state_lock:
+                self.save_partial_state(part_path, file, segments=segments)
+
+        def downloaded():
+            return sum(segment[2] for segment in segments)
+
+        # The segment threads already count their bytes, the progress bus reads them from there
+        with self.progress.transfer(file_name, size, downloaded(), counter=downloaded), \
+                ThreadPoolExecutor(max_workers=len(segments)) as pool:
+            results = list(pool.map(
+                lambda segment: self.download_segment(url, part_path, segment, save_state),
+                segments,
+            ))
+        save_state()
+
+        if not self.downloading:
+            return "partial", full_path  # Paused, finished segments are kept for the next attempt
+        if not all(results):
+            print(f"Incomplete download of {file_name}, unfinished segments are retried later.")
+            return "partial", full_path
+        if os.path.getsize(part_path) != size:
+            print(f"Size mismatch for {file_name}: expected {size} bytes.")
+            self.discard_partial(part_path)
+            return "failed", full_path
+        # Segments arrive out of order, so the assembled file is hashed once at the end
+        if file.get("md5Checksum") and file_md5(part_path).hexdigest() != file["md5Checksum"]:
+            print(f"Checksum mismatch for {file_name}, queued for another attempt.")
+            self.discard_partial(part_path)
+            return "corrupt", full_path
+
+        os.replace(part_path, full_path)
+        os.remove(part_path + ".json")
+        print(f"Downloaded {file_name} successfully ({len(segments)} segments).")
+        return "done", full_path
+
+    def download_segment(self, url, part_path, segment, save_state):
+        # segment is [start, end, written] with end inclusive; written is updated as bytes land
+        start, end, _ = segment
+        if start + segment[2] > end:
+            return True
+        headers = {"Range": f"bytes={start + segment[2]}-{end}"}
+        try:
+            with self.transport.get(url, headers=headers, stream=True) as response:
+                response.raise_for_status()
+                if response.status_code != 206:
+                    print(f"Server ignored the range {headers['Range']}, segment not downloaded.")
+                    return False
+                with open(part_path, "r+b") as f:
+                    f.seek(start + segment[2])
+                    checkpoint = segment[2]
+                    for block in self.transport.iter_blocks(response):
+                        if not self.downloading:
+                            break
+                        self.metrics.write(f, block)
+                        segment[2] += len(block)
+                        if segment[2] - checkpoint >= CHECKPOINT_BYTES:
+                            f.flush()
+                            save_state()
+                            checkpoint = segment[2]
+        except requests.exceptions.RequestException as e:
+            print(f"Failed to download bytes {start}-{end}: {e}")
+        return start + segment[2] > end
+
+    def resume_path(self, file):
+        # A file paused in an earlier run goes back to the path its .part file was started for
+        path = file.get("localPath")
+        if not path or not os.path.exists(path + PART_SUFFIX):
+            return None
+        with self.lock:
+            if self.is_claimed(path, file["id"]):
+                return None
+            self.claimed_paths.add(path)
+        return path
+
+    def load_partial_state(self, part_path, file):
+        # Sidecar of part_path if it belongs to this version of the file, otherwise None
+        try:
+            with open(part_path + ".json", "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        same_version = (
+            state.get("id") == file["id"]
+            and state.get("modifiedTime") == file.get("modifiedTime")
+            and state.get("md5Checksum") == file.get("md5Checksum")
+        )
+        return state if same_version and os.path.exists(part_path) else None
+
+    def partial_offset(self, part_path, file):
+        # Bytes of part_path that can be kept, or 0 when there is nothing valid to resume from
+        state = self.load_partial_state(part_path, file)
+        if state is None or "offset" not in state:
+            return 0
+        return min(int(state["offset"]), os.path.getsize(part_path))
+
+    def partial_segments(self, part_path, file, size):
+        # Segments to carry on with, or None to start from scratch
+        state = self.load_partial_state(part_path, file)
+        if state is None:
+            return None
+        if "segments" in state:
+            return [list(segment) for segment in state["segments"]]
+        # A single-stream partial keeps its bytes as a finished first segment
+        offset = min(int(state.get("offset", 0)), os.path.getsize(part_path), size)
+        if not offset:
+            return None
+        return [[0, offset - 1, offset]] + split_segments(offset, size, max(1, self.segment_count - 1))
+
+    def save_partial_state(self, part_path, file, offset=None, segments=None):
+        state = {
+            "id": file["id"],
+            "modifiedTime": file.get("modifiedTime"),
+            "md5Checksum": file.get("md5Checksum"),
+        }
+        if segments is not None:
+            state["segments"] = segments
+        else:
+            state["offset"] = offset
+        with open(part_path + ".json", "w", encoding="utf-8") as f:
+            json.dump(state, f)
+
+    def discard_partial(self, part_path):
+        for path in (part_path, part_path + ".json"):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def get_filename(self, output_dir, file_name, size=None, file_id=None):
+        # size is the one in the listing; a local file of another size is an unfinished copy, not a match
+        base_name, ext = os.path.splitext(file_name)
+        path = os.path.join(output_dir, file_name)
+        size = int(size) if size is not None else None
+
+        # Decide and claim the path in one step so two workers never write the same file.
+        # Existence and sizes come from the local index, not from a stat per file.
+        with self.lock:
+            claimed = self.is_claimed(path, file_id)
+            if claimed or self.local_index.exists(path):
+                if self.exists_action == "skip":
+                    if claimed or self.local_index.matches(path, size):
+                        return None  # Skip file
+                elif self.exists_action == "replace":
+                    if claimed:
+                        return None  # Already being written by another worker in this run
+                elif self.exists_action == "rename":
+                    # Numbering resumes where the last rename in this folder stopped
+                    key = (output_dir, base_name, ext)
+                    counter = self.rename_counters.get(key, 1)
+                    while self.is_claimed(path, file_id) or self.local_index.exists(path):
+                        path = os.path.join(output_dir, f"{base_name} ({counter}){ext}")
+                        counter += 1
+                    self.rename_counters[key] = counter
+            self.claimed_paths.add(path)
+        return path
+
+    def is_claimed(self, path, file_id=None):
+        # Caller holds self.lock. In queue mode the path is also claimed in the shared queue, where
+        # another process may hold it for another file of the same name.
+        if path in self.claimed_paths:
+            return True
+        if not (self.queue_mode and self.work_queue and file_id):
+            return False
+        return not self.work_queue.claim_path(os.path.relpath(path, self.save_dir), file_id)
@@ -1,25 +1,29 @@
 import os
-import requests
+import queue
 import threading
 import tkinter as tk
 from tkinter import filedialog, messagebox
 from time import time
-from googleapiclient.discovery import build
-from google.oauth2.service_account import Credentials
+from drive_core import DriveDownloader
+from progress import format_progress
 
-class DownloaderApp:
+UI_POLL_MS = 200  # How often the window picks up status messages and progress from the workers
+
+class DownloaderApp(DriveDownloader):
     def __init__(self, root):
+        super().__init__()
         self.root = root
         self.root.title("Google Drive Folder Downloader")
-        self.root.geometry("500x400")
+        self.root.geometry("500x470")
         self.root.configure(bg="gray")
 
-        self.folder_links = []
         self.save_path = tk.StringVar()
-        self.downloading = False
-        self.file_list = []
-        self.downloaded_files = set()  # Store downloaded files
         self.file_exists_action = tk.StringVar(value="skip")  # Variable to store file handling action
+        self.max_workers = tk.IntVar(value=4)  # Number of files downloaded at the same time
+        self.sync_mode = tk.BooleanVar(value=False)  # Only apply Drive changes since the last run
+        self.async_mode = tk.BooleanVar(value=False)  # asyncio backend for folders with very many small files
+        self.dedupe = tk.BooleanVar(value=False)  # Identical files are downloaded once and copied locally
+        self.process_thread = None
 
         # UI components
         link_frame = tk.Frame(root, bg="gray")
@@ -93,6 +97,37 @@ class DownloaderApp:
             bg="gray",
             fg="black",
         ).pack(side=tk.LEFT, padx=5)
+        tk.Checkbutton(
+            file_exists_frame,
+            text="Copy duplicates",
+            variable=self.dedupe,
+            bg="gray",
+            fg="black",
+        ).pack(side=tk.LEFT, padx=5)
+
+        workers_frame = tk.Frame(root, bg="gray")
+        workers_frame.pack(pady=5)
+
+        tk.Label(workers_frame, text="Workers:", bg="gray", fg="white").pack(
+            side=tk.LEFT, padx=5
+        )
+        tk.Spinbox(
+            workers_frame, from_=1, to=32, textvariable=self.max_workers, width=5
+        ).pack(side=tk.LEFT, padx=5)
+        tk.Checkbutton(
+            workers_frame,
+            text="Sync changes only",
+            variable=self.sync_mode,
+            bg="gray",
+            fg="black",
+        ).pack(side=tk.LEFT, padx=5)
+        tk.Checkbutton(
+            workers_frame,
+            text="Many small files",
+            variable=self.async_mode,
+            bg="gray",
+            fg="black",
+        ).pack(side=tk.LEFT, padx=5)
 
         button_frame = tk.Frame(root, bg="gray")
         button_frame.pack(pady=5)
@@ -110,15 +145,36 @@ class DownloaderApp:
 
         self.status_label = tk.Label(root, text="Status: Waiting to start...", fg="blue", bg="gray")
         self.status_label.pack(pady=5)
+        self.progress_label = tk.Label(root, text="", fg="white", bg="gray")
+        self.progress_label.pack(pady=5)
 
-        self.service = self.initialize_drive_service()
+        self.ui_events = queue.Queue()  # Status messages and errors posted by worker threads
+        self.shown_progress = None
+        self.root.after(UI_POLL_MS, self.poll_events)
 
-    def initialize_drive_service(self):
-        creds = Credentials.from_service_account_file(
-            "credentials.json", scopes=["https://www.googleapis.com/auth/drive"]
-        )
-        service = build("drive", "v3", credentials=creds)
-        return service
+    def set_status(self, text, color="blue"):
+        self.ui_events.put(("status", text, color))
+
+    def show_error(self, message):
+        self.ui_events.put(("error", message, None))
+
+    def poll_events(self):
+        # Tk is not thread-safe, so widgets are only updated here, on the main thread
+        while True:
+            try:
+                kind, text, color = self.ui_events.get_nowait()
+            except queue.Empty:
+                break
+            if kind == "status":
+                self.status_label.config(text=text, fg=color)
+            else:
+                messagebox.showerror("Error", text)
+
+        snapshot = self.progress.latest
+        if snapshot is not None and snapshot is not self.shown_progress:
+            self.progress_label.config(text=format_progress(snapshot))
+            self.shown_progress = snapshot
+        self.root.after(UI_POLL_MS, self.poll_events)
 
     def choose_save_path(self):
         path = filedialog.askdirectory()
@@ -151,15 +207,27 @@ class DownloaderApp:
             if not file_path:
                 return
 
+            folder_ids = {link: self.extract_folder_id(link) for link in self.folder_links}
+            folder_names, errors = self.get_folder_names([fid for fid in folder_ids.values() if fid])
+            for folder_link, folder_id in folder_ids.items():
+                if folder_id in errors:
+                    print(f"Error fetching folder name for {folder_link}: {errors[folder_id]}")
+
+            manifest = self.existing_manifest(self.save_path.get())
+
             with open(file_path, "w", encoding="utf-8") as f:
                 for folder_link in self.folder_links:
-                    folder_id = self.extract_folder_id(folder_link)
-                    folder_name = self.get_folder_name(folder_id)
+                    folder_id = folder_ids[folder_link]
+                    folder_name = folder_names.get(folder_id)
                     f.write(f"{folder_link}\t{folder_name}\n")
 
-                    for file in self.fetch_all_files(folder_id):
-                        if file['name'] in self.downloaded_files:
-                            f.write(f"\t{file['path']}/{file['name']}\n")
+                    # Downloaded files come straight from the manifest, no need to list the folder again
+                    entries = set()
+                    if manifest and folder_id:
+                        entries.update(f"{file['path']}/{file['name']}" for file in manifest.done_files(folder_id))
+                    entries.update(e for e in self.downloaded_files if os.path.normpath(e).split(os.sep)[0] == folder_name)
+                    for entry in sorted(entries):
+                        f.write(f"\t{entry}\n")
 
             messagebox.showinfo("Info", "List has been successfully exported!")
         except Exception as e:
@@ -178,159 +246,47 @@ class DownloaderApp:
             self.downloaded_files = set()
 
             for line in lines:
-                line = line.strip()
-                if not line:
+                if not line.strip():
                     continue
                 if not line.startswith("\t"):
-                    parts = line.split("\t")
+                    parts = line.strip().split("\t")
                     if len(parts) == 2:
                         link, _ = parts
                         self.folder_links.append(link)
                 else:
-                    file_path = line.lstrip("\t")
-                    file_name = os.path.basename(file_path)
-                    self.downloaded_files.add(file_name)
+                    self.downloaded_files.add(line.strip())
 
             messagebox.showinfo("Info", "List has been successfully imported!")
         except Exception as e:
             messagebox.showerror("Error", f"Error importing list: {e}")
 
-    def extract_folder_id(self, folder_link):
-        try:
-            if "folders" in folder_link:
-                return folder_link.split("/folders/")[1].split("?")[0]
-            return folder_link.split("/")[-1].split("?")[0]
-        except IndexError:
-            return None
-
-    def get_folder_name(self, folder_id):
-        try:
-            folder = self.service.files().get(fileId=folder_id, fields="name").execute()
-            return folder.get("name")
-        except Exception as e:
-            print(f"Error fetching folder name: {e}")
-            return None
-
     def start_download(self):
         if not self.folder_links or not self.save_path.get():
             messagebox.showerror("Error", "Please provide folder links and a save path!")
             return
 
+        if self.process_thread and self.process_thread.is_alive():
+            messagebox.showinfo("Info", "Workers are still stopping, please try again in a moment.")
+            return
+
         self.status_label.config(text="Fetching file lists...", fg="green")
         self.downloading = True
 
-        threading.Thread(target=self.process_links).start()
+        self.read_settings()
+        self.process_thread = threading.Thread(target=self.process_links)
+        self.process_thread.start()
 
-    def process_links(self):
+    def read_settings(self):
+        # Tk variables are read here, on the main thread, so workers only see plain values
+        self.save_dir = self.save_path.get()
+        self.exists_action = self.file_exists_action.get()
         try:
-            for folder_link in self.folder_links:
-                if not self.downloading:
-                    break
-
-                folder_id = self.extract_folder_id(folder_link)
-                if not folder_id:
-                    messagebox.showerror("Error", f"Invalid folder link: {folder_link}")
-                    continue
-
-                folder_name = self.get_folder_name(folder_id)
-                if not folder_name:
-                    messagebox.showerror("Error", f"Failed to fetch folder name for: {folder_link}")
-                    continue
-
-                target_path = os.path.join(self.save_path.get(), folder_name)
-                os.makedirs(target_path, exist_ok=True)
-
-                self.file_list = self.fetch_all_files(folder_id, current_path=folder_name)
-                if not self.file_list:
-                    messagebox.showerror("Error", f"No files found in folder: {folder_link}")
-                    continue
-
-                self.status_label.config(text=f"Found {len(self.file_list)} files. Starting download...", fg="green")
-
-                for file in self.file_list:
-                    if not self.downloading:
-                        break
-                    if file['name'] in self.downloaded_files:
-                        continue  # Skip already downloaded files
-                    self.download_file(file["id"], file["name"], os.path.join(self.save_path.get(), file['path']))
-
-            self.status_label.config(text="Download completed!" if self.downloading else "Paused.", fg="blue")
-            self.downloading = False
-        except Exception as e:
-            messagebox.showerror("Error", f"An error occurred: {str(e)}")
-            self.status_label.config(text="Error downloading files.", fg="red")
-
-    def fetch_all_files(self, folder_id, current_path=""):
-        try:
-            all_files = []
-
-            results = self.service.files().list(
-                q=f"'{folder_id}' in parents and trashed=false",
-                fields="files(id, name, mimeType)"
-            ).execute()
-
-            items = results.get("files", [])
-
-            for item in items:
-                if item["mimeType"] == "application/vnd.google-apps.folder":
-                    subfolder_path = os.path.join(current_path, item["name"])
-                    subfolder_files = self.fetch_all_files(item["id"], current_path=subfolder_path)
-                    all_files.extend(subfolder_files)
-                else:
-                    all_files.append({"id": item["id"], "name": item["name"], "path": current_path})
-
-            return all_files
-        except Exception as e:
-            print(f"Error fetching file list: {e}")
-            return []
-
-    def download_file(self, file_id, file_name, output_dir):
-        base_url = "https://www.googleapis.com/drive/v3/files"
-        session = requests.Session()
-
-        url = f"{base_url}/{file_id}?alt=media"
-        headers = {"Authorization": f"Bearer {self.service._http.credentials.token}"}
-
-        full_path = self.get_filename(output_dir, file_name)
-        if not full_path:
-            return  # Skip if no download needed
-
-        try:
-            os.makedirs(output_dir, exist_ok=True)  # Ensure directory exists
-            with session.get(url, headers=headers, stream=True) as response:
-                response.raise_for_status()
-                total_size = int(response.headers.get('content-length', 0))
-                downloaded = 0
-                
-                with open(full_path, "wb") as f:
-                    for chunk in response.iter_content(32768):
-                        if not self.downloading:
-                            break
-                        if chunk:
-                            f.write(chunk)
-                            downloaded += len(chunk)
-                            percentage = (downloaded / total_size) * 100 if total_size > 0 else 0
-                            print(f"Downloading {file_name}: {percentage:.2f}%", end="\r")
-                print(f"Downloaded {file_name} successfully.")
-            self.downloaded_files.add(file_name)  # Save successfully downloaded file
-        except requests.exceptions.RequestException as e:
-            print(f"Failed to download {file_name}: {e}")
-
-    def get_filename(self, output_dir, file_name):
-        base_name, ext = os.path.splitext(file_name)
-        path = os.path.join(output_dir, file_name)
-
-        if os.path.exists(path):
-            if self.file_exists_action.get() == "skip":
-                return None  # Skip file
-            elif self.file_exists_action.get() == "replace":
-                return path  # Overwrite file
-            elif self.file_exists_action.get() == "rename":
-                counter = 1
-                while os.path.exists(path):
-                    path = os.path.join(output_dir, f"{base_name} ({counter}){ext}")
-                    counter += 1
-        return path
+            self.worker_count = max(1, int(self.max_workers.get()))
+        except (tk.TclError, ValueError):
+            self.worker_count = 1
+        self.sync_enabled = self.sync_mode.get()
+        self.use_async = self.async_mode.get()
+        self.dedupe_mode = "reflink" if self.dedupe.get() else None  # A plain copy where reflinks are not supported
 
     def pause_download(self):
         self.downloading = False
@@ -338,9 +294,14 @@ class DownloaderApp:
 
     def resume_download(self):
         if not self.downloading:
+            if self.process_thread and self.process_thread.is_alive():
+                messagebox.showinfo("Info", "Workers are still stopping, please try again in a moment.")
+                return
             self.downloading = True
             self.status_label.config(text="Resuming download...", fg="green")
-            threading.Thread(target=self.process_links).start()
+            self.read_settings()
+            self.process_thread = threading.Thread(target=self.process_links)
+            self.process_thread.start()
 
 if __name__ == "__main__":
     root = tk.Tk()
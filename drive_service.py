@@ -0,0 +1,53 @@
+import os
+import json
+
+DISCOVERY_URL = "https://www.googleapis.com/discovery/v1/apis/drive/v3/rest"
+DISCOVERY_PATH = os.path.join(os.path.expanduser("~"), ".drive_downloader", "drive.v3.json")
+SCOPES = ["https://www.googleapis.com/auth/drive"]
+
+# googleapiclient and google-auth are imported on first use, they are most of the startup time
+
+
+def load_credentials(credentials_file):
+    from google.oauth2.service_account import Credentials
+
+    return Credentials.from_service_account_file(credentials_file, scopes=SCOPES)
+
+
+def load_discovery_document(path=DISCOVERY_PATH):
+    # The Drive v3 document bundled with google-api-python-client 2.x, or a copy cached by an
+    # earlier run; only a 1.x install without a cached copy goes to the network, and only once.
+    try:
+        from googleapiclient.discovery_cache import get_static_doc
+
+        document = get_static_doc("drive", "v3")
+        if document:
+            return document
+    except ImportError:
+        pass  # 1.x releases ship no documents
+
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            return f.read()
+
+    import requests
+
+    response = requests.get(DISCOVERY_URL, timeout=30)
+    response.raise_for_status()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        f.write(response.text)
+    os.replace(temp_path, path)  # A half-written copy would break every later start
+    return response.text
+
+
+def build_drive_service(credentials, root_url=None):
+    from googleapiclient.discovery import build_from_document
+
+    document = load_discovery_document()
+    if root_url:
+        # Calls and batch requests are both addressed from rootUrl
+        document = json.loads(document) if isinstance(document, str) else dict(document)
+        document["rootUrl"] = root_url
+    return build_from_document(document, credentials=credentials)
@@ -0,0 +1,116 @@
+import re
+import json
+from fnmatch import fnmatchcase
+
+FOLDER_MIME_TYPE = "application/vnd.google-apps.folder"
+SIZE_UNITS = {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+
+
+class FileFilter:
+    """Which files of a folder tree a job keeps: name globs, mimeTypes, size and modifiedTime bounds.
+
+    mimeType and modifiedTime go into the files().list query, so Drive never returns what they
+    exclude. Name globs and sizes have no exact form there and are checked while crawling; a folder
+    whose name matches an exclude glob is not listed at all.
+    """
+
+    def __init__(self, include=(), exclude=(), mime_types=(), min_size=None, max_size=None,
+                 modified_after=None, modified_before=None):
+        self.include = [pattern.lower() for pattern in include]
+        self.exclude = [pattern.lower() for pattern in exclude]
+        self.mime_types = list(mime_types)  # "image/*" or "image/" match every image type
+        self.min_size = min_size
+        self.max_size = max_size
+        self.modified_after = parse_time(modified_after)
+        self.modified_before = parse_time(modified_before)
+
+    def query(self):
+        # Extra files().list condition; folders always pass so the crawl can go on below them
+        terms = []
+        if self.mime_types:
+            terms.append("(" + " or ".join(mime_term(mime_type) for mime_type in self.mime_types) + ")")
+        if self.modified_after:
+            terms.append(f"modifiedTime >= '{self.modified_after}'")
+        if self.modified_before:
+            terms.append(f"modifiedTime < '{self.modified_before}'")
+        if not terms:
+            return ""
+        return f" and (mimeType = '{FOLDER_MIME_TYPE}' or ({' and '.join(terms)}))"
+
+    def signature(self):
+        # Every setting that decides which files a crawl keeps, "" when there are none. A manifest root
+        # listed with another signature is missing files this job wants, so it is listed again.
+        settings = {
+            "include": self.include, "exclude": self.exclude, "mime_types": self.mime_types,
+            "min_size": self.min_size, "max_size": self.max_size,
+            "modified_after": self.modified_after, "modified_before": self.modified_before,
+        }
+        used = {key: value for key, value in settings.items() if value is not None and value != []}
+        return json.dumps(used, sort_keys=True) if used else ""
+
+    def walks(self, folder_name):
+        return not any(fnmatchcase(folder_name.lower(), pattern) for pattern in self.exclude)
+
+    def matches(self, file):
+        # Works on listing items and on file records; records from the manifest also have their folders checked,
+        # all but the first one: that is the linked folder itself, which the job downloads whatever its name
+        name = file["name"].lower()
+        if any(fnmatchcase(name, pattern) for pattern in self.exclude):
+            return False
+        if self.include and not any(fnmatchcase(name, pattern) for pattern in self.include):
+            return False
+        if not all(self.walks(part) for part in re.split(r"[\\/]", file.get("path") or "")[1:] if part):
+            return False
+        if self.mime_types and not any(mime_matches(file.get("mimeType"), mime_type) for mime_type in self.mime_types):
+            return False
+
+        size = file.get("size")
+        if size is not None:  # Workspace files have no size, size bounds do not apply to them
+            if self.min_size is not None and int(size) < self.min_size:
+                return False
+            if self.max_size is not None and int(size) > self.max_size:
+                return False
+
+        modified = file.get("modifiedTime")
+        if modified:  # RFC 3339 in UTC compares correctly as text
+            if self.modified_after and modified < self.modified_after:
+                return False
+            if self.modified_before and modified >= self.modified_before:
+                return False
+        return True
+
+
+def mime_term(mime_type):
+    if mime_type.endswith("/*") or mime_type.endswith("/"):
+        return f"mimeType contains '{quote(mime_type.rstrip('*'))}'"
+    return f"mimeType = '{quote(mime_type)}'"
+
+
+def mime_matches(value, mime_type):
+    if mime_type.endswith("/*") or mime_type.endswith("/"):
+        return (value or "").startswith(mime_type.rstrip("*"))
+    return value == mime_type
+
+
+def quote(value):
+    return value.replace("\\", "\\\\").replace("'", "\\'")
+
+
+def parse_time(value):
+    # "2024-05-01", "2024-05-01T12:00" or "2024-05-01T12:00:00" in UTC, completed to the RFC 3339
+    # date-time Drive reads in a query and its modifiedTime values compare against as text
+    if not value:
+        return None
+    value = value.rstrip("Z")
+    match = re.fullmatch(r"(\d{4}-\d{2}-\d{2})(T\d{2}:\d{2})?(:\d{2}(\.\d+)?)?", value)
+    if not match or (match.group(3) and not match.group(2)):
+        raise ValueError(f"Not a UTC date or time: {value}")
+    return match.group(1) + (match.group(2) or "T00:00") + (match.group(3) or ":00")
+
+
+def parse_size(value):
+    # "500", "20K", "1.5G": bytes, with binary units
+    match = re.fullmatch(r"(\d+(?:\.\d+)?)\s*([KMGT]?)B?", value.strip().upper())
+    if not match:
+        raise ValueError(f"Not a size: {value}")
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2)])
@@ -0,0 +1,77 @@
+import os
+import json
+import sqlite3
+import threading
+from time import time
+
+CACHE_PATH = os.path.join(os.path.expanduser("~"), ".drive_downloader", "listing_cache.sqlite3")
+DEFAULT_TTL = 3600  # Seconds a folder listing is trusted without asking Drive again
+
+
+class ListingCache:
+    """Children of Drive folders keyed by folder ID, kept on disk for ttl seconds.
+
+    A listing made with extra query terms is stored as "<folder ID> <terms>" next to the full one.
+    """
+
+    def __init__(self, path=CACHE_PATH, ttl=DEFAULT_TTL):
+        self.path = path
+        self.ttl = ttl
+        self.lock = threading.Lock()  # Shared by the crawler threads
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS listings (
+                folder_id TEXT PRIMARY KEY,
+                modified_time TEXT,
+                fetched_at REAL NOT NULL,
+                items TEXT NOT NULL
+            )
+            """
+        )
+        self.db.commit()
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def get(self, folder_id, modified_time=None):
+        # Cached children of folder_id, or None when missing, expired or the folder changed since.
+        # modified_time is the folder's current modifiedTime when the caller knows it (from its parent).
+        with self.lock:
+            row = self.db.execute(
+                "SELECT modified_time, fetched_at, items FROM listings WHERE folder_id = ?", (folder_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        cached_modified_time, fetched_at, items = row
+        if time() - fetched_at > self.ttl:
+            return None
+        if modified_time is not None and modified_time != cached_modified_time:
+            return None
+        return json.loads(items)
+
+    def put(self, folder_id, items, modified_time=None):
+        with self.lock, self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO listings (folder_id, modified_time, fetched_at, items) VALUES (?, ?, ?, ?)",
+                (folder_id, modified_time, time(), json.dumps(items)),
+            )
+
+    def set_ttl(self, ttl):
+        # Expired listings are dropped here, once per run, with the TTL the run was started with
+        self.ttl = ttl
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM listings WHERE fetched_at < ?", (time() - ttl,))
+
+    def invalidate(self, folder_ids):
+        # Drops the full listing of every folder and any filtered ones
+        with self.lock, self.db:
+            self.db.executemany(
+                "DELETE FROM listings WHERE folder_id = ? OR substr(folder_id, 1, ?) = ?",
+                [(fid, len(fid) + 1, fid + " ") for fid in folder_ids],
+            )
@@ -0,0 +1,64 @@
+import os
+import threading
+
+
+class LocalIndex:
+    """Names, sizes and mtimes under the save path, read with one scandir per directory."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.directories = {}  # directory -> {name: (size, mtime), or None when not known, stat() reads it then}
+
+    def entries(self, directory):
+        # Caller holds self.lock. One scandir per directory, however many files are looked up in it;
+        # on Windows DirEntry.stat() comes with the listing, elsewhere it is one stat per entry, once.
+        key = os.path.normcase(directory)
+        entries = self.directories.get(key)
+        if entries is None:
+            entries = {}
+            try:
+                with os.scandir(directory) as listing:
+                    for entry in listing:
+                        try:
+                            result = entry.stat()
+                            entries[os.path.normcase(entry.name)] = (result.st_size, result.st_mtime)
+                        except OSError:
+                            entries[os.path.normcase(entry.name)] = None  # Removed or unreadable since the listing
+            except (FileNotFoundError, NotADirectoryError):
+                pass  # Not created yet, everything in it is new
+            self.directories[key] = entries
+        return entries
+
+    def exists(self, path):
+        directory, name = os.path.split(path)
+        with self.lock:
+            return os.path.normcase(name) in self.entries(directory)
+
+    def stat(self, path):
+        # (size, mtime) of an indexed file, or None when it is not there
+        directory, name = os.path.split(path)
+        name = os.path.normcase(name)
+        with self.lock:
+            entries = self.entries(directory)
+            if name not in entries:
+                return None
+            if entries[name] is None:
+                try:
+                    result = os.stat(path)
+                    entries[name] = (result.st_size, result.st_mtime)
+                except OSError:
+                    del entries[name]  # Removed since the scan
+                    return None
+            return entries[name]
+
+    def matches(self, path, size):
+        # True when the file is there with the size the listing gave (any size when the listing had none)
+        info = self.stat(path)
+        if info is None:
+            return False
+        return size is None or info[0] == size
+
+    def add(self, path, size=None, mtime=None):
+        directory, name = os.path.split(path)
+        with self.lock:
+            self.entries(directory)[os.path.normcase(name)] = (size, mtime) if size is not None else None
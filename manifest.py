@@ -0,0 +1,319 @@
+import os
+import sqlite3
+import threading
+from time import time
+
+MANIFEST_NAME = ".drive_manifest.sqlite3"
+RESUME_ATTEMPTS = 3  # Failed runs of one file after which its root is listed again instead of resumed
+
+
+class DownloadManifest:
+    """Download state for one save path, stored in SQLite and keyed by Drive file ID."""
+
+    def __init__(self, save_dir, shared=False):
+        self.save_dir = save_dir
+        self.shared = shared  # Written by several processes, possibly on other hosts over a network filesystem
+        self.path = os.path.join(save_dir, MANIFEST_NAME)
+        self.lock = threading.Lock()  # One connection is shared by every worker thread
+
+        os.makedirs(save_dir, exist_ok=True)
+        self.db = sqlite3.connect(self.path, timeout=60 if shared else 5, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        # WAL needs shared memory, which a network filesystem cannot give to processes on other hosts
+        self.db.execute("PRAGMA journal_mode=DELETE" if shared else "PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS roots (
+                id TEXT PRIMARY KEY,
+                name TEXT,
+                crawled_at REAL,
+                page_token TEXT,
+                complete INTEGER NOT NULL DEFAULT 1,
+                filters TEXT NOT NULL DEFAULT ''
+            );
+            CREATE TABLE IF NOT EXISTS folders (
+                id TEXT PRIMARY KEY,
+                root_id TEXT NOT NULL,
+                path TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS files (
+                id TEXT PRIMARY KEY,
+                root_id TEXT NOT NULL,
+                name TEXT NOT NULL,
+                path TEXT NOT NULL,
+                size INTEGER,
+                md5 TEXT,
+                modified_time TEXT,
+                local_path TEXT,
+                status TEXT NOT NULL DEFAULT 'pending',
+                updated_at REAL,
+                local_md5 TEXT,
+                mime_type TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE INDEX IF NOT EXISTS files_root_status ON files (root_id, status);
+            """
+        )
+        root_columns = [row["name"] for row in self.db.execute("PRAGMA table_info(roots)")]
+        if "page_token" not in root_columns:
+            self.db.execute("ALTER TABLE roots ADD COLUMN page_token TEXT")  # Manifests written before sync mode
+        if "complete" not in root_columns:
+            self.db.execute("ALTER TABLE roots ADD COLUMN complete INTEGER NOT NULL DEFAULT 1")
+        if "filters" not in root_columns:
+            self.db.execute("ALTER TABLE roots ADD COLUMN filters TEXT NOT NULL DEFAULT ''")
+        file_columns = [row["name"] for row in self.db.execute("PRAGMA table_info(files)")]
+        if "local_md5" not in file_columns:
+            self.db.execute("ALTER TABLE files ADD COLUMN local_md5 TEXT")  # Manifests written before verification
+        if "mime_type" not in file_columns:
+            self.db.execute("ALTER TABLE files ADD COLUMN mime_type TEXT")  # Manifests written before Workspace export
+        if "attempts" not in file_columns:
+            self.db.execute("ALTER TABLE files ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+        self.db.execute("CREATE INDEX IF NOT EXISTS files_local_md5 ON files (local_md5)")
+        self.db.commit()
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def has_unfinished_job(self, root_id, filters=""):
+        # A root completely crawled with the same filters and with files still waiting can be resumed without
+        # listing it again. Files that keep failing do not count after RESUME_ATTEMPTS runs, or new files
+        # would never be found.
+        with self.lock:
+            crawled = self.db.execute(
+                "SELECT 1 FROM roots WHERE id = ? AND complete AND filters = ?", (root_id, filters)
+            ).fetchone()
+            if not crawled:
+                return False
+            waiting = self.db.execute(
+                "SELECT 1 FROM files WHERE root_id = ? AND (status = 'pending'"
+                " OR (status NOT IN ('done', 'skipped') AND attempts < ?)) LIMIT 1",
+                (root_id, RESUME_ATTEMPTS),
+            ).fetchone()
+            return waiting is not None
+
+    def save_listing(self, root_id, root_name, files, folders=None, page_token=None, complete=True, filters=""):
+        # Files whose content did not change keep their status, everything else goes back to pending.
+        # page_token is the changes feed position taken before the crawl, used by sync mode later;
+        # filters is the FileFilter signature the crawl kept files by.
+        # A listing with folders that could not be read is saved incomplete, the next run lists the root again.
+        # A complete one also drops the files that left the tree: deleted, trashed or moved out in Drive.
+        now = time()
+        with self.lock, self.db:
+            self.upsert_files(root_id, files, now)
+            if complete:
+                listed = {file["id"] for file in files}
+                self.db.executemany(
+                    "DELETE FROM files WHERE id = ?",
+                    [
+                        (row["id"],)
+                        for row in self.db.execute("SELECT id FROM files WHERE root_id = ?", (root_id,)).fetchall()
+                        if row["id"] not in listed
+                    ],
+                )
+            if folders is not None:
+                self.db.execute("DELETE FROM folders WHERE root_id = ?", (root_id,))
+                self.db.executemany(
+                    "INSERT OR REPLACE INTO folders (id, root_id, path) VALUES (?, ?, ?)",
+                    [(folder_id, root_id, path) for folder_id, path in folders.items()],
+                )
+            self.db.execute(
+                "INSERT OR REPLACE INTO roots (id, name, crawled_at, page_token, complete, filters)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (root_id, root_name, now, page_token, int(complete), filters),
+            )
+
+    def upsert_files(self, root_id, files, now=None):
+        # Caller holds self.lock and the transaction. A changed file keeps its local path only when it
+        # was done, so "pending" with a path always means a copy written here that is out of date.
+        now = now or time()
+        rows = [
+            (
+                file["id"], root_id, file["name"], file["path"],
+                int(file["size"]) if file.get("size") is not None else None,
+                file.get("md5Checksum"), file.get("modifiedTime"), file.get("mimeType"), now,
+            )
+            for file in files
+        ]
+        self.db.executemany(
+            """
+            INSERT INTO files (id, root_id, name, path, size, md5, modified_time, mime_type, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (id) DO UPDATE SET
+                root_id = excluded.root_id,
+                name = excluded.name,
+                path = excluded.path,
+                size = excluded.size,
+                md5 = excluded.md5,
+                modified_time = excluded.modified_time,
+                mime_type = excluded.mime_type,
+                status = CASE
+                    WHEN files.local_md5 IS NOT NULL AND files.local_md5 = excluded.md5 THEN files.status
+                    WHEN files.md5 IS excluded.md5 AND files.modified_time IS excluded.modified_time
+                    THEN files.status ELSE 'pending' END,
+                attempts = CASE
+                    WHEN files.local_md5 IS NOT NULL AND files.local_md5 = excluded.md5 THEN files.attempts
+                    WHEN files.md5 IS excluded.md5 AND files.modified_time IS excluded.modified_time
+                    THEN files.attempts ELSE 0 END,
+                local_path = CASE
+                    WHEN files.local_md5 IS NOT NULL AND files.local_md5 = excluded.md5 THEN files.local_path
+                    WHEN files.md5 IS excluded.md5 AND files.modified_time IS excluded.modified_time
+                    THEN files.local_path WHEN files.status = 'done' THEN files.local_path ELSE NULL END,
+                updated_at = excluded.updated_at
+            """,
+            rows,
+        )
+
+    def pending_files(self, root_id):
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT * FROM files WHERE root_id = ? AND status != 'done'", (root_id,)
+            ).fetchall()
+        return [self.to_record(row) for row in rows]
+
+    def done_files(self, root_id):
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT * FROM files WHERE root_id = ? AND status = 'done'", (root_id,)
+            ).fetchall()
+        return [self.to_record(row) for row in rows]
+
+    def count_files(self, root_id):
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM files WHERE root_id = ?", (root_id,)).fetchone()[0]
+
+    def mark(self, file, status, local_path=None):
+        # A file only reaches "done" after its bytes matched md5Checksum, so that hash is kept as verified
+        local_md5 = file.get("md5Checksum") if status == "done" else None
+        with self.lock, self.db:
+            self.db.execute(
+                "UPDATE files SET status = ?, local_path = COALESCE(?, local_path), local_md5 = ?, updated_at = ?,"
+                " attempts = CASE WHEN ? IN ('failed', 'partial', 'corrupt') THEN attempts + 1 ELSE 0 END"
+                " WHERE id = ?",
+                (status, local_path, local_md5, time(), status, file["id"]),
+            )
+
+    def find_content(self, md5, size):
+        # Local path of a verified file with these bytes, from any root, that is still on disk
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT local_path FROM files WHERE local_md5 = ? AND size = ? AND status = 'done'", (md5, size)
+            ).fetchall()
+        for row in rows:
+            path = row["local_path"]
+            if path and os.path.isfile(path) and os.path.getsize(path) == size:
+                return path
+        return None
+
+    def page_tokens(self, root_ids, filters=""):
+        # {root_id: changes page token} for the roots completely listed with these filters that have one
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT id, page_token FROM roots WHERE complete AND filters = ?"
+                f" AND id IN ({','.join('?' * len(root_ids))})",
+                [filters] + list(root_ids),
+            ).fetchall()
+        return {row["id"]: row["page_token"] for row in rows if row["page_token"]}
+
+    def set_page_token(self, root_ids, page_token):
+        with self.lock, self.db:
+            self.db.executemany(
+                "UPDATE roots SET page_token = ? WHERE id = ?", [(page_token, root_id) for root_id in root_ids]
+            )
+
+    def mark_incomplete(self, root_id):
+        # Part of the tree is missing from the manifest, sync mode cannot build on it any more
+        with self.lock, self.db:
+            self.db.execute("UPDATE roots SET complete = 0 WHERE id = ?", (root_id,))
+
+    def get_folder(self, folder_id):
+        # (root_id, path) of a tracked folder, or None
+        with self.lock:
+            row = self.db.execute("SELECT root_id, path FROM folders WHERE id = ?", (folder_id,)).fetchone()
+        return (row["root_id"], row["path"]) if row else None
+
+    def get_file(self, file_id):
+        with self.lock:
+            row = self.db.execute("SELECT * FROM files WHERE id = ?", (file_id,)).fetchone()
+        return self.to_record(row) if row else None
+
+    def add_files(self, root_id, files, folders=None):
+        with self.lock, self.db:
+            self.upsert_files(root_id, files)
+            self.db.executemany(
+                "INSERT OR REPLACE INTO folders (id, root_id, path) VALUES (?, ?, ?)",
+                [(folder_id, root_id, path) for folder_id, path in (folders or {}).items()],
+            )
+
+    def remove_file(self, file_id):
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM files WHERE id = ?", (file_id,))
+
+    def remove_folder(self, folder_id):
+        # Forget a folder and everything below it, returning the file records that were dropped
+        folder = self.get_folder(folder_id)
+        if folder is None:
+            return []
+        root_id, path = folder
+        with self.lock, self.db:
+            files = [
+                self.to_record(row)
+                for row in self.db.execute("SELECT * FROM files WHERE root_id = ?", (root_id,))
+                if is_within(row["path"], path)
+            ]
+            folder_ids = [
+                row["id"]
+                for row in self.db.execute("SELECT id, path FROM folders WHERE root_id = ?", (root_id,))
+                if is_within(row["path"], path)
+            ]
+            self.db.executemany("DELETE FROM files WHERE id = ?", [(file["id"],) for file in files])
+            self.db.executemany("DELETE FROM folders WHERE id = ?", [(fid,) for fid in folder_ids])
+        return files
+
+    def move_folder(self, folder_id, new_path):
+        # Rewrite the stored paths of a renamed or moved folder and everything below it
+        folder = self.get_folder(folder_id)
+        if folder is None:
+            return
+        root_id, old_path = folder
+        old_local = os.path.join(self.save_dir, old_path)
+        new_local = os.path.join(self.save_dir, new_path)
+        with self.lock, self.db:
+            folders = self.db.execute("SELECT id, path FROM folders WHERE root_id = ?", (root_id,)).fetchall()
+            self.db.executemany(
+                "UPDATE folders SET path = ? WHERE id = ?",
+                [(new_path + row["path"][len(old_path):], row["id"]) for row in folders if is_within(row["path"], old_path)],
+            )
+            files = self.db.execute("SELECT id, path, local_path FROM files WHERE root_id = ?", (root_id,)).fetchall()
+            self.db.executemany(
+                "UPDATE files SET path = ?, local_path = ? WHERE id = ?",
+                [
+                    (
+                        new_path + row["path"][len(old_path):],
+                        new_local + row["local_path"][len(old_local):]
+                        if row["local_path"] and is_within(row["local_path"], old_local) else row["local_path"],
+                        row["id"],
+                    )
+                    for row in files if is_within(row["path"], old_path)
+                ],
+            )
+
+    @staticmethod
+    def to_record(row):
+        # Same shape as the records built by DriveDownloader.fetch_all_files
+        return {
+            "id": row["id"],
+            "name": row["name"],
+            "path": row["path"],
+            "size": row["size"],
+            "md5Checksum": row["md5"],
+            "modifiedTime": row["modified_time"],
+            "mimeType": row["mime_type"],
+            "localPath": row["local_path"],
+            "status": row["status"],
+        }
+
+
+def is_within(path, folder):
+    return path == folder or path.startswith(folder + os.sep)
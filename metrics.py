@@ -0,0 +1,163 @@
+import os
+import json
+import threading
+from time import perf_counter, time
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)  # Seconds
+STATS_INTERVAL = 10  # Seconds between two writes of the JSON stats file
+PROMETHEUS_PREFIX = "drive_downloader"
+
+
+def endpoint_name(url, params=None):
+    # Drive method behind a plain HTTP call, named like the API calls made through googleapiclient
+    path, _, query = url.partition("?")
+    if path.endswith("/export"):
+        return "files.export"
+    if "alt=media" in query or (params or {}).get("alt") == "media":
+        return "files.download"
+    if path.endswith("/files"):
+        return "files.list"
+    return "files.get"
+
+
+class Metrics:
+    """Latency histograms, response codes, retries and bytes per Drive endpoint and for disk writes.
+
+    Counters only grow, across runs too, as a Prometheus scraper expects.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time()
+        self.endpoints = {}
+
+    def endpoint(self, name):
+        # Caller holds self.lock
+        stats = self.endpoints.get(name)
+        if stats is None:
+            stats = {
+                "count": 0,
+                "seconds": 0.0,
+                "buckets": [0] * len(LATENCY_BUCKETS),  # Per bucket, made cumulative when exported
+                "codes": {},
+                "retries": 0,
+                "bytes": 0,
+                "body_seconds": 0.0,
+            }
+            self.endpoints[name] = stats
+        return stats
+
+    def observe(self, name, seconds, code=None, retry=False, size=0):
+        # One attempt of a call; code is the HTTP status, or "connection" when none came back
+        with self.lock:
+            stats = self.endpoint(name)
+            stats["count"] += 1
+            stats["seconds"] += seconds
+            for index, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    stats["buckets"][index] += 1
+                    break
+            if code is not None:
+                stats["codes"][str(code)] = stats["codes"].get(str(code), 0) + 1
+            if retry:
+                stats["retries"] += 1
+            stats["bytes"] += size
+
+    def add_body(self, name, size, seconds):
+        # Bytes of a response body and the time from its headers to its end, disk writes included
+        with self.lock:
+            stats = self.endpoint(name)
+            stats["bytes"] += size
+            stats["body_seconds"] += seconds
+
+    def write(self, f, block):
+        # f.write(block), timed as the disk-write phase
+        started = perf_counter()
+        f.write(block)
+        self.observe("disk.write", perf_counter() - started, size=len(block))
+
+    def snapshot(self):
+        with self.lock:
+            endpoints = {
+                name: dict(stats, buckets=list(stats["buckets"]), codes=dict(stats["codes"]))
+                for name, stats in self.endpoints.items()
+            }
+        for stats in endpoints.values():
+            errors = sum(count for code, count in stats["codes"].items() if not code.isdigit() or int(code) >= 400)
+            stats["errors"] = errors
+            stats["mean_seconds"] = stats["seconds"] / stats["count"] if stats["count"] else None
+        return {"started": self.started, "time": time(), "buckets": list(LATENCY_BUCKETS), "endpoints": endpoints}
+
+    def write_json(self, path, progress=None):
+        # Replaced in one step, a reader never sees half a file
+        stats = self.snapshot()
+        stats["progress"] = progress
+        temp_path = path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(stats, f, indent=1)
+        os.replace(temp_path, path)
+
+    def prometheus(self, progress=None):
+        # Text exposition format, version 0.0.4
+        stats = self.snapshot()["endpoints"]
+        name = PROMETHEUS_PREFIX
+        lines = [
+            f"# HELP {name}_request_seconds Time of one Drive call or disk write, up to the response headers.",
+            f"# TYPE {name}_request_seconds histogram",
+        ]
+        for endpoint, values in sorted(stats.items()):
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS, values["buckets"]):
+                cumulative += count
+                lines.append(f'{name}_request_seconds_bucket{{endpoint="{endpoint}",le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_request_seconds_bucket{{endpoint="{endpoint}",le="+Inf"}} {values["count"]}')
+            lines.append(f'{name}_request_seconds_sum{{endpoint="{endpoint}"}} {values["seconds"]:.6f}')
+            lines.append(f'{name}_request_seconds_count{{endpoint="{endpoint}"}} {values["count"]}')
+
+        counters = (
+            ("responses_total", "Responses by HTTP status, \"connection\" when none came back.", None),
+            ("retries_total", "Attempts after the first one.", "retries"),
+            ("bytes_total", "Bytes received, or written for disk.write.", "bytes"),
+            ("body_seconds_total", "Time spent reading response bodies, disk writes included.", "body_seconds"),
+        )
+        for metric, help_text, key in counters:
+            lines.append(f"# HELP {name}_{metric} {help_text}")
+            lines.append(f"# TYPE {name}_{metric} counter")
+            for endpoint, values in sorted(stats.items()):
+                if key is None:
+                    for code, count in sorted(values["codes"].items()):
+                        lines.append(f'{name}_{metric}{{endpoint="{endpoint}",code="{code}"}} {count}')
+                else:
+                    lines.append(f'{name}_{metric}{{endpoint="{endpoint}"}} {values[key]}')
+
+        for key, value in (progress or {}).items():
+            if isinstance(value, (int, float)):  # Totals, rates and the ETA of the current run
+                lines.append(f"# TYPE {name}_progress_{key} gauge")
+                lines.append(f"{name}_progress_{key} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def serve_metrics(metrics, port, progress=None):
+    # Metrics.prometheus() at http://127.0.0.1:port/metrics from a daemon thread; progress() returns the
+    # latest progress snapshot, published as gauges. http.server is only loaded when this is asked for.
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics.prometheus(progress() if progress else None).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
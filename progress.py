@@ -0,0 +1,153 @@
+import threading
+from collections import deque
+from contextlib import contextmanager
+from time import monotonic
+
+PROGRESS_INTERVAL = 0.5  # Seconds between two published updates
+RATE_WINDOW = 5.0  # Seconds of history behind bytes/s and files/s
+
+
+class Transfer:
+    """One file on its way down; only the worker that owns it writes to it."""
+
+    def __init__(self, name, size, offset=0, counter=None):
+        self.name = name
+        self.size = size
+        self.offset = offset  # Bytes kept from an earlier attempt, not counted as throughput
+        self.received = 0
+        self.counter = counter  # Reads the position itself when several threads fill the same file
+        self.started = monotonic()
+
+    def advance(self, count):
+        self.received += count
+
+    def position(self):
+        return self.counter() if self.counter else self.offset + self.received
+
+
+class ProgressBus:
+    """Counters bumped by the download workers, published as throttled snapshots by one thread."""
+
+    def __init__(self, interval=PROGRESS_INTERVAL):
+        self.interval = interval
+        self.lock = threading.Lock()  # Guards the totals and the set of transfers, never taken per chunk
+        self.subscribers = []
+        self.thread = None
+        self.stop_event = threading.Event()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.files_total = 0
+            self.bytes_total = 0
+            self.files_done = 0
+            self.bytes_done = 0  # Sizes of the files finished this run, whatever their status
+            self.transferred = 0  # Bytes received by transfers that already ended
+            self.transfers = set()
+            self.samples = deque()
+            self.latest = None
+
+    def subscribe(self, callback):
+        # callback(snapshot) runs on the publishing thread
+        self.subscribers.append(callback)
+
+    def start(self):
+        self.reset()
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+        self.publish()  # Final numbers, even when the run was shorter than one interval
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            self.publish()
+
+    def publish(self):
+        self.latest = self.snapshot()
+        for callback in self.subscribers:
+            try:
+                callback(self.latest)
+            except Exception as e:
+                print(f"Progress update failed: {e}")
+
+    def add_work(self, files):
+        with self.lock:
+            self.files_total += len(files)
+            self.bytes_total += sum(int(file["size"]) for file in files if file.get("size") is not None)
+
+    def finish_file(self, file):
+        with self.lock:
+            self.files_done += 1
+            self.bytes_done += int(file["size"]) if file.get("size") is not None else 0
+
+    @contextmanager
+    def transfer(self, name, size, offset=0, counter=None):
+        transfer = Transfer(name, size, offset, counter)
+        with self.lock:
+            self.transfers.add(transfer)
+        try:
+            yield transfer
+        finally:
+            with self.lock:
+                self.transfers.discard(transfer)
+                self.transferred += transfer.position() - transfer.offset
+
+    def snapshot(self):
+        now = monotonic()
+        with self.lock:
+            active = sorted(self.transfers, key=lambda transfer: transfer.started)
+            transferred = self.transferred + sum(transfer.position() - transfer.offset for transfer in active)
+            bytes_done = self.bytes_done + sum(transfer.position() for transfer in active)
+            files_done = self.files_done
+            self.samples.append((now, transferred, files_done))
+            while len(self.samples) > 1 and now - self.samples[0][0] > RATE_WINDOW:
+                self.samples.popleft()
+            since, transferred_then, files_then = self.samples[0]
+
+        elapsed = now - since
+        bytes_per_second = (transferred - transferred_then) / elapsed if elapsed > 0 else 0.0
+        files_per_second = (files_done - files_then) / elapsed if elapsed > 0 else 0.0
+        remaining = max(0, self.bytes_total - bytes_done)
+        return {
+            "files_done": files_done,
+            "files_total": self.files_total,
+            "bytes_done": bytes_done,
+            "bytes_total": self.bytes_total,
+            "bytes_per_second": bytes_per_second,
+            "files_per_second": files_per_second,
+            "eta_seconds": remaining / bytes_per_second if bytes_per_second > 0 else None,
+            "workers": [
+                {"name": transfer.name, "received": transfer.position(), "size": transfer.size}
+                for transfer in active
+            ],
+        }
+
+
+def format_bytes(count):
+    for unit in ("B", "KB", "MB", "GB"):
+        if count < 1024:
+            return f"{int(count)} B" if unit == "B" else f"{count:.1f} {unit}"
+        count /= 1024
+    return f"{count:.1f} TB"
+
+
+def format_progress(snapshot):
+    # One line for the console and the status bar
+    eta = snapshot["eta_seconds"]
+    if eta is None:
+        eta_text = "--:--"
+    else:
+        minutes, seconds = divmod(int(eta), 60)
+        eta_text = f"{minutes // 60}:{minutes % 60:02d}:{seconds:02d}" if minutes >= 60 else f"{minutes}:{seconds:02d}"
+    return (
+        f"{snapshot['files_done']}/{snapshot['files_total']} files, "
+        f"{format_bytes(snapshot['bytes_done'])} of {format_bytes(snapshot['bytes_total'])}, "
+        f"{format_bytes(snapshot['bytes_per_second'])}/s, {snapshot['files_per_second']:.1f} files/s, "
+        f"ETA {eta_text}, {len(snapshot['workers'])} active"
+    )
@@ -0,0 +1,92 @@
+import json
+import random
+import asyncio
+import threading
+from time import monotonic, sleep
+
+MAX_RETRIES = 6  # Attempts after the first one before a call is given up
+BACKOFF_BASE = 1.0  # Seconds, doubled on every attempt
+BACKOFF_CAP = 64.0
+QUOTA_REASONS = {"userRateLimitExceeded", "rateLimitExceeded"}
+
+
+def error_reason(content):
+    # The "reason" of a Drive error body, e.g. userRateLimitExceeded
+    try:
+        if isinstance(content, bytes):
+            content = content.decode("utf-8", "replace")
+        error = json.loads(content)["error"]
+        errors = error.get("errors") or [{}]
+        return errors[0].get("reason") or error.get("status")
+    except (ValueError, KeyError, TypeError, AttributeError, IndexError):
+        return None
+
+
+def is_quota_error(status, reason):
+    return status == 429 or (status == 403 and reason in QUOTA_REASONS)
+
+
+def is_retryable(status, reason):
+    return is_quota_error(status, reason) or status >= 500
+
+
+def retry_after_seconds(value):
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None  # HTTP-date form is not used by Drive, fall back to our own backoff
+
+
+class RateController:
+    """Token bucket shared by every Drive call of one account, with its rate tuned by AIMD from quota responses."""
+
+    def __init__(self, rate=10.0, min_rate=0.5, max_rate=100.0, increase=0.5, decrease=0.5):
+        self.rate = rate  # Requests per second currently allowed
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase  # Requests per second gained per second of clean responses
+        self.decrease = decrease  # Factor applied to the rate on every quota error
+        self.lock = threading.Lock()
+        self.tokens = rate
+        self.updated = monotonic()
+        self.blocked_until = 0.0  # Retry-After and backoff pauses hold every caller, not just one
+
+    def reserve(self, tokens=1):
+        # Takes tokens and returns how long to wait until they are paid for; a large batch runs into debt
+        with self.lock:
+            now = monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= tokens
+            return max(-self.tokens / self.rate, self.blocked_until - now, 0.0)
+
+    def acquire(self, tokens=1):
+        wait = self.reserve(tokens)
+        if wait:
+            sleep(wait)
+
+    async def acquire_async(self, tokens=1):
+        wait = self.reserve(tokens)
+        if wait:
+            await asyncio.sleep(wait)
+
+    def on_success(self):
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.increase / self.rate)
+
+    def on_throttle(self):
+        with self.lock:
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            self.tokens = min(self.tokens, 0.0)
+
+    def backoff(self, attempt, retry_after=None):
+        # Seconds to hold everyone off: Retry-After when Drive sent one, otherwise full-jitter exponential
+        delay = retry_after_seconds(retry_after)
+        if delay is None:
+            delay = random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+        self.hold(delay)
+        return delay
+
+    def hold(self, seconds):
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, monotonic() + seconds)
@@ -0,0 +1,169 @@
+import threading
+from datetime import datetime, timedelta, timezone
+from http.client import HTTPException
+from time import monotonic, perf_counter, sleep
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import HTTPError as Urllib3Error
+
+from metrics import endpoint_name
+from rate_limit import MAX_RETRIES, error_reason, is_quota_error, is_retryable
+
+REFRESH_MARGIN = timedelta(minutes=5)  # Refresh the access token this long before it expires
+TIMEOUT = (30, 300)  # (connect, read) seconds for every request
+READ_BLOCK_MIN = 64 * 1024  # Bytes asked of the socket at first and after a stall
+READ_BLOCK_MAX = 1024 * 1024  # Size of the reused per-thread buffer, and of the largest disk write
+FAST_BLOCK = 0.02  # Seconds; a block filled faster than this doubles the next one
+SLOW_BLOCK = 0.25  # Seconds; a block slower than this halves it, so pause and progress stay responsive
+
+
+class DriveTransport:
+    """A keep-alive connection pool for Drive downloads, shared by every worker thread."""
+
+    def __init__(self, accounts, pool_size=4, metrics=None):
+        self.accounts = accounts  # CredentialPool shared with the API calls
+        self.pool_size = pool_size
+        self.metrics = metrics  # Metrics of every attempt, token refresh and body read, if any
+        self.thread_local = threading.local()  # One receive buffer per thread, reused for every file
+        from google.auth.transport.requests import Request  # Loaded with the credentials, not at startup
+
+        self.refresh_request = Request()  # Token refreshes of every account, over one requests session
+
+        # One pool per host, large enough for every worker to keep its own connection open
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, pool_block=True)
+        self.session = requests.Session()
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def close(self):
+        self.session.close()
+
+    def token(self, account):
+        credentials = account.credentials
+        if needs_refresh(credentials):
+            with account.refresh_lock:
+                if needs_refresh(credentials):  # Another worker may have refreshed while this one waited
+                    self.refresh(credentials)
+        return credentials.token
+
+    def force_refresh(self, account, stale_token):
+        with account.refresh_lock:
+            if account.credentials.token == stale_token:  # Skip if another worker already replaced it
+                self.refresh(account.credentials)
+
+    def refresh(self, credentials):
+        # Caller holds the account's refresh_lock
+        started = perf_counter()
+        credentials.refresh(self.refresh_request)
+        if self.metrics:
+            self.metrics.observe("oauth.token", perf_counter() - started)
+
+    def get(self, url, headers=None, **kwargs):
+        # Adds the bearer token; a 401 means the token was revoked early, so refresh once and retry.
+        # Quota and server errors are retried here with backoff, each attempt on the next account in turn.
+        kwargs.setdefault("timeout", TIMEOUT)
+        endpoint = endpoint_name(url, kwargs.get("params"))
+        refreshed = False
+        attempt = 0
+        while True:
+            account = self.accounts.take()
+            account.rate.acquire()
+            token = self.token(account)
+            request_headers = dict(headers or {})
+            request_headers["Authorization"] = f"Bearer {token}"
+            request_headers.setdefault("Accept-Encoding", "identity")  # Media bytes as stored, see iter_blocks
+            started = perf_counter()
+            try:
+                response = self.session.get(url, headers=request_headers, **kwargs)
+            except requests.exceptions.RequestException:
+                self.observe(endpoint, started, "connection", attempt or refreshed)
+                raise
+            self.observe(endpoint, started, response.status_code, attempt or refreshed)
+
+            if response.status_code == 401 and not refreshed:
+                response.close()
+                self.force_refresh(account, token)
+                refreshed = True
+                continue
+            if response.status_code < 400:
+                account.rate.on_success()
+                return response
+
+            reason = error_reason(response.content) if response.status_code == 403 else None
+            if not is_retryable(response.status_code, reason) or attempt == MAX_RETRIES:
+                return response
+            response.close()
+            quota = is_quota_error(response.status_code, reason)
+            sleep(self.accounts.backoff(account, attempt, response.headers.get("Retry-After"), quota))
+            attempt += 1
+
+    def observe(self, endpoint, started, code, retry):
+        # Time to the response headers; the body is accounted for by iter_blocks
+        if self.metrics:
+            self.metrics.observe(endpoint, perf_counter() - started, code, retry=bool(retry))
+
+    def read_buffer(self):
+        buffer = getattr(self.thread_local, "buffer", None)
+        if buffer is None:
+            buffer = bytearray(READ_BLOCK_MAX)
+            self.thread_local.buffer = buffer
+        return buffer
+
+    def iter_blocks(self, response):
+        # Body of a streamed response as memoryviews of this thread's buffer, filled by readinto()
+        # without a bytes object per chunk. A view is only valid until the next one is taken.
+        # Blocks grow while the connection keeps up and shrink again when it stalls.
+        reader = body_reader(response)
+        view = memoryview(self.read_buffer())
+        block = READ_BLOCK_MIN
+        received = 0
+        body_started = perf_counter()
+        try:
+            while True:
+                started = monotonic()
+                filled = 0
+                try:
+                    while filled < block:
+                        count = reader.readinto(view[filled:block])
+                        if not count:
+                            break
+                        filled += count
+                except (OSError, HTTPException, Urllib3Error) as e:
+                    # Raised as iter_content would, so callers keep catching RequestException
+                    raise requests.exceptions.ConnectionError(e, response=response)
+                received += filled
+                if filled:
+                    yield view[:filled]
+                if filled < block:
+                    break  # End of the body
+                elapsed = monotonic() - started
+                if elapsed < FAST_BLOCK:
+                    block = min(READ_BLOCK_MAX, block * 2)
+                elif elapsed > SLOW_BLOCK:
+                    block = max(READ_BLOCK_MIN, block // 2)
+            if reader is not response.raw:
+                response.raw.release_conn()  # The body was read past urllib3, hand the connection back ourselves
+        finally:
+            if self.metrics:  # Also when the caller stopped early (pause) or the connection broke
+                self.metrics.add_body(endpoint_name(response.url), received, perf_counter() - body_started)
+
+
+def needs_refresh(credentials):
+    if not credentials.token:
+        return True
+    expiry = credentials.expiry  # Naive UTC, as google-auth stores it
+    if expiry is None:
+        return False
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    return now >= expiry - REFRESH_MARGIN
+
+
+def body_reader(response):
+    # The socket file under urllib3 when the body is sent as is; its readinto() fills our buffer in place.
+    # urllib3's own readinto() reads into a new bytes object first, so it is only used to decode a body.
+    fp = getattr(response.raw, "_fp", None)
+    if response.headers.get("Content-Encoding", "identity") == "identity" and hasattr(fp, "readinto"):
+        return fp
+    response.raw.decode_content = True
+    return response.raw
@@ -0,0 +1,209 @@
+import os
+import json
+import uuid
+import socket
+import sqlite3
+import threading
+from time import time
+
+QUEUE_NAME = ".drive_queue.sqlite3"
+LEASE_SECONDS = 120  # A file not renewed for this long goes back to the queue, its worker is presumed dead
+MAX_ATTEMPTS = 3  # Leases of one file before a "partial" result is taken as final
+BUSY_TIMEOUT = 60000  # Milliseconds to wait for another process holding the database lock
+
+
+class WorkQueue:
+    """Files of a job leased to downloader processes, which may run on several hosts sharing the save path.
+
+    A lease is renewed by a heartbeat while its process is alive, so a file is handed out again only
+    when its worker stopped renewing it. The database keeps a rollback journal rather than WAL, which
+    needs shared memory that network filesystems do not provide; NFS must have working locks (lockd).
+    """
+
+    def __init__(self, save_dir, lease_seconds=LEASE_SECONDS):
+        self.path = os.path.join(save_dir, QUEUE_NAME)
+        self.lease_seconds = lease_seconds
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.lock = threading.Lock()  # One connection is shared by the workers of this process
+        self.heartbeat = None
+        self.stopped = threading.Event()
+
+        os.makedirs(save_dir, exist_ok=True)
+        self.db = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT / 1000, check_same_thread=False, isolation_level=None)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT}")
+        self.db.execute("PRAGMA journal_mode=DELETE")
+        self.db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS crawls (
+                root_id TEXT PRIMARY KEY,
+                owner TEXT,
+                lease_until REAL,
+                ready INTEGER NOT NULL DEFAULT 0,
+                listed_at REAL
+            );
+            CREATE TABLE IF NOT EXISTS tasks (
+                id TEXT PRIMARY KEY,
+                root_id TEXT NOT NULL,
+                record TEXT NOT NULL,
+                state TEXT NOT NULL DEFAULT 'queued',
+                owner TEXT,
+                lease_until REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                status TEXT
+            );
+            CREATE INDEX IF NOT EXISTS tasks_root_state ON tasks (root_id, state);
+            CREATE TABLE IF NOT EXISTS paths (
+                path TEXT PRIMARY KEY,
+                file_id TEXT NOT NULL
+            );
+            """
+        )
+
+    def close(self):
+        self.stop_heartbeat()
+        with self.lock:
+            self.db.close()
+
+    def transaction(self):
+        # BEGIN IMMEDIATE takes the write lock up front, so two processes never lease the same rows
+        self.db.execute("BEGIN IMMEDIATE")
+        return self.db
+
+    def claim_crawl(self, root_id, since):
+        # "crawl" when this process should list the root, "ready" when another one already did, "wait" otherwise.
+        # A listing older than since (when this process joined) whose files are all done belongs to a
+        # finished job, this run lists the root again.
+        now = time()
+        with self.lock:
+            db = self.transaction()
+            try:
+                row = db.execute(
+                    "SELECT owner, lease_until, ready, listed_at FROM crawls WHERE root_id = ?", (root_id,)
+                ).fetchone()
+                unfinished = db.execute(
+                    "SELECT 1 FROM tasks WHERE root_id = ? AND state != 'done' LIMIT 1", (root_id,)
+                ).fetchone()
+                if row and row["ready"] and (unfinished or row["listed_at"] >= since):
+                    result = "ready"
+                elif row and not row["ready"] and row["owner"] != self.owner and row["lease_until"] > now:
+                    result = "wait"
+                else:
+                    db.execute(
+                        "INSERT OR REPLACE INTO crawls (root_id, owner, lease_until) VALUES (?, ?, ?)",
+                        (root_id, self.owner, now + self.lease_seconds),
+                    )
+                    # Nobody downloads this root now, its local paths are handed out again by the next job
+                    db.execute("DELETE FROM paths WHERE file_id IN (SELECT id FROM tasks WHERE root_id = ?)", (root_id,))
+                    result = "crawl"
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+        return result
+
+    def add(self, root_id, files):
+        # Queued once per file id. A file finished in an earlier job is queued again, the manifest only
+        # hands back files that failed or changed since; one still queued or leased is left alone.
+        rows = [(file["id"], root_id, json.dumps(file)) for file in files]
+        with self.lock:
+            db = self.transaction()
+            try:
+                db.executemany(
+                    "INSERT INTO tasks (id, root_id, record) VALUES (?, ?, ?)"
+                    " ON CONFLICT (id) DO UPDATE SET record = excluded.record, state = 'queued', attempts = 0,"
+                    " status = NULL WHERE tasks.state = 'done'",
+                    rows,
+                )
+                db.execute("UPDATE crawls SET ready = 1, listed_at = ? WHERE root_id = ?", (time(), root_id))
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+
+    def lease(self, root_id, count):
+        # Up to count queued files, or files whose lease ran out, now held by this process
+        now = time()
+        with self.lock:
+            db = self.transaction()
+            try:
+                rows = db.execute(
+                    "SELECT id, record FROM tasks WHERE root_id = ?"
+                    " AND (state = 'queued' OR (state = 'leased' AND lease_until < ?)) LIMIT ?",
+                    (root_id, now, count),
+                ).fetchall()
+                db.executemany(
+                    "UPDATE tasks SET state = 'leased', owner = ?, lease_until = ?, attempts = attempts + 1 WHERE id = ?",
+                    [(self.owner, now + self.lease_seconds, row["id"]) for row in rows],
+                )
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+        return [json.loads(row["record"]) for row in rows]
+
+    def complete(self, file_id, status):
+        # Finishes a file this process still holds. "partial" puts it back for another lease, until
+        # MAX_ATTEMPTS; returns False when the lease was lost to another process in the meantime.
+        with self.lock:
+            cursor = self.db.execute(
+                "UPDATE tasks SET state = CASE WHEN ? = 'partial' AND attempts < ? THEN 'queued' ELSE 'done' END,"
+                " status = ?, owner = NULL, lease_until = NULL WHERE id = ? AND owner = ? AND state = 'leased'",
+                (status, MAX_ATTEMPTS, status, file_id, self.owner),
+            )
+        return cursor.rowcount == 1
+
+    def release(self, file_ids):
+        # Leased files this process will not get to (paused), back to the queue without counting an attempt
+        with self.lock:
+            self.db.executemany(
+                "UPDATE tasks SET state = 'queued', owner = NULL, lease_until = NULL, attempts = attempts - 1"
+                " WHERE id = ? AND owner = ? AND state = 'leased'",
+                [(file_id, self.owner) for file_id in file_ids],
+            )
+
+    def claim_path(self, path, file_id):
+        # True when path (relative to the save path) is free or already held by file_id. Two files of the
+        # same name leased to two processes would otherwise both be written to it, the last one winning.
+        key = os.path.normcase(path).replace(os.sep, "/")
+        with self.lock:
+            self.db.execute("INSERT OR IGNORE INTO paths (path, file_id) VALUES (?, ?)", (key, file_id))
+            row = self.db.execute("SELECT file_id FROM paths WHERE path = ?", (key,)).fetchone()
+        return row["file_id"] == file_id
+
+    def unfinished(self, root_id):
+        with self.lock:
+            row = self.db.execute(
+                "SELECT COUNT(*) FROM tasks WHERE root_id = ? AND state != 'done'", (root_id,)
+            ).fetchone()
+        return row[0]
+
+    def renew(self):
+        with self.lock:
+            self.db.execute(
+                "UPDATE tasks SET lease_until = ? WHERE owner = ? AND state = 'leased'",
+                (time() + self.lease_seconds, self.owner),
+            )
+            self.db.execute(
+                "UPDATE crawls SET lease_until = ? WHERE owner = ? AND ready = 0",
+                (time() + self.lease_seconds, self.owner),
+            )
+
+    def start_heartbeat(self):
+        if self.heartbeat is None:
+            self.stopped.clear()
+            self.heartbeat = threading.Thread(target=self.beat, daemon=True)
+            self.heartbeat.start()
+
+    def stop_heartbeat(self):
+        if self.heartbeat is not None:
+            self.stopped.set()
+            self.heartbeat.join()
+            self.heartbeat = None
+
+    def beat(self):
+        while not self.stopped.wait(self.lease_seconds / 3):
+            try:
+                self.renew()
+            except sqlite3.Error as e:
+                print(f"Could not renew leases: {e}")